@@ -10,6 +10,8 @@ import sys
 
 import requests
 
+import http_client
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 HINDENBURG_HISTORY_FILE = os.path.join(BASE_DIR, "hindenburg_history.json")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
@@ -267,14 +269,14 @@ def upsert_hindenburg_entry(history, entry):
 
 
 def bootstrap_barchart_session(seed_symbol="$ADVN"):
-    session = requests.Session()
+    session = http_client.new_session()
     seed_path = requests.utils.quote(str(seed_symbol), safe="")
     seed_url = f"https://www.barchart.com/stocks/quotes/{seed_path}/price-history/historical"
     headers = {
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,image/apng,*/*;q=0.8"
     }
-    resp = session.get(seed_url, headers=headers, timeout=20)
+    resp = http_client.get(seed_url, session=session, headers=headers, timeout=20)
     if resp.status_code != 200:
         return None, None, None
     m = re.search(r'<meta name="csrf-token" content="([^"]+)"', resp.text)
@@ -304,11 +306,11 @@ def parse_barchart_history_csv(raw_text):
 
 
 def fetch_barchart_history_series(symbol, maxrecords=300, session=None, csrf_token=None, xsrf_token=None):
-    local_session = session or requests.Session()
+    api_url = "https://www.barchart.com/proxies/timeseries/queryeod.ashx"
+    local_session = session or http_client.get_session(api_url)
     sym_text = str(symbol).strip()
     quote_path = requests.utils.quote(sym_text, safe="")
     referer_url = f"https://www.barchart.com/stocks/quotes/{quote_path}/price-history/historical"
-    api_url = "https://www.barchart.com/proxies/timeseries/queryeod.ashx"
     params = {
         "symbol": sym_text,
         "data": "historical",
@@ -332,7 +334,7 @@ def fetch_barchart_history_series(symbol, maxrecords=300, session=None, csrf_tok
     if xsrf_token:
         headers["X-XSRF-TOKEN"] = str(xsrf_token)
 
-    resp = local_session.get(api_url, params=params, headers=headers, timeout=20)
+    resp = http_client.get(api_url, session=local_session, params=params, headers=headers, timeout=20)
     if resp.status_code != 200:
         return []
     return parse_barchart_history_csv(resp.text)
@@ -349,7 +351,7 @@ def fetch_yahoo_chart_with_dates(symbol="^NYA", range_key="1y", interval="1d"):
         "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
         "Accept": "application/json,text/plain,*/*"
     }
-    resp = requests.get(url, params=params, headers=headers, timeout=15)
+    resp = http_client.get(url, params=params, headers=headers, timeout=15)
     if resp.status_code != 200:
         return []
     payload = resp.json()
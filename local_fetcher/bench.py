@@ -0,0 +1,393 @@
+"""
+Micro-benchmarks for the hot paths of main.py.
+
+Usage:
+  python bench.py html PAGE.html [PAGE.html ...] [--repeat N]
+  python bench.py spam THREAD.dat [THREAD.dat ...] [--repeat N] [--extra-terms N]
+  python bench.py tickers THREAD.dat [THREAD.dat ...] [--repeat N] [--extra-nicknames N] [--no-ahocorasick]
+  python bench.py parse THREAD.dat [THREAD.dat ...] [--repeat N] [--processes N]
+  python bench.py topics THREAD.dat|TEXT.txt [...] [--repeat N]
+  python bench.py topic-filter THREAD.dat|TEXT.txt [...] [--repeat N] [--backend NAME]
+
+Inputs are saved copies of real data (a 5ch read.cgi page, the IndexMood
+advance-decline page, raw or cached DAT files, ...). Each benchmark checks
+that the new code produces the same output as the reference implementation
+before timing it.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+
+import html_extract
+import topic_tokenizers
+
+
+def load_main():
+    # Importing main exits (exit(1)) without GEMINI_API_KEY, so set a placeholder.
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    import main
+    return main
+
+
+def read_text(path):
+    with open(path, "rb") as f:
+        raw = f.read()
+    # 5ch pages are CP932; IndexMood and most others are UTF-8.
+    for encoding in ("utf-8", "CP932"):
+        try:
+            return raw.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="replace")
+
+
+def time_call(fn, arg, repeat):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(arg)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def bench_html(args):
+    reference = html_extract.get_backend("bs4")
+    backends = [html_extract.get_backend(name) for name in html_extract.available_backends()]
+    print(f"backends: {', '.join(b.name for b in backends)}")
+
+    for path in args.pages:
+        html = read_text(path)
+        print(f"\n{os.path.basename(path)} ({len(html):,} chars)")
+        for label in ("message_texts", "page_text"):
+            expected = getattr(reference, label)(html)
+            base = time_call(getattr(reference, label), html, args.repeat)
+            for backend in backends:
+                fn = getattr(backend, label)
+                same = fn(html) == expected
+                elapsed = time_call(fn, html, args.repeat)
+                speedup = base / elapsed if elapsed else float("inf")
+                print(f"  {label:<14} {backend.name:<11} {elapsed * 1000:8.2f} ms  x{speedup:5.1f}  {'same' if same else 'DIFF'}")
+
+
+def reference_spam_score(main, message, spam_list, dup_counter, id_counter, user_id=None):
+    # spam_score_message as it was before the single-pass matcher/features.
+    if not message:
+        return 999
+    for s in spam_list:
+        if s and s in message:
+            return 999
+    score = 0
+    length = len(message)
+    if length <= 2:
+        score += 3
+    elif length <= 5:
+        score += 1
+    if length >= 500:
+        score += 2
+    if length >= 1000:
+        score += 3
+    if main.SPAM_REPEAT_PATTERN.search(message):
+        score += 3
+    if main.SPAM_NOISE_PATTERN.search(message):
+        score += 2
+    if main.SPAM_URL_PATTERN.search(message):
+        score += 2
+    compact = main.WHITESPACE_PATTERN.sub("", message)
+    if compact:
+        meaningful = len(main.SPAM_MEANINGFUL_PATTERN.findall(compact))
+        ratio = meaningful / max(len(compact), 1)
+        if ratio < 0.3 and len(compact) > 10:
+            score += 2
+    norm = main.normalize_message(message)
+    if norm:
+        dup_counter[norm] = dup_counter.get(norm, 0) + 1
+        if dup_counter[norm] > main.SPAM_DUP_THRESHOLD:
+            score += 3
+        elif dup_counter[norm] > 1:
+            score += 1
+    if user_id:
+        id_counter[user_id] = id_counter.get(user_id, 0) + 1
+        if id_counter[user_id] > main.SPAM_ID_LIMIT and length < 60:
+            score += 2
+        if id_counter[user_id] > main.SPAM_ID_LIMIT + 10:
+            score += 2
+    if main.SPAM_TICKER_HINT_PATTERN.search(message):
+        score = max(score - 2, 0)
+    return score
+
+
+def dat_posts(main, paths):
+    posts = []
+    for path in paths:
+        for line in read_text(path).split("\n")[1:]:
+            parts = line.split("<>", 4)
+            if len(parts) >= 4:
+                msg = main.clean_message(parts[3])
+                if msg:
+                    posts.append((msg, main.extract_post_id(parts[2])))
+    return posts
+
+
+def bench_spam(args):
+    main = load_main()
+    _, _, matcher, _ = main.load_config()
+    # Synthetic never-matching terms show how matching scales with the list size.
+    spam_list = list(matcher) + [f"__bench_spam_{i}__" for i in range(args.extra_terms)]
+    matcher = main.SpamMatcher(spam_list)
+    posts = dat_posts(main, args.dats)
+    print(f"{len(posts):,} posts, {len(spam_list)} spam terms")
+
+    def score_all(scorer, spam):
+        dup_counter, id_counter = {}, {}
+        return [scorer(msg, spam, dup_counter, id_counter, user_id) for msg, user_id in posts]
+
+    def run_reference(_):
+        return score_all(lambda *a: reference_spam_score(main, *a), spam_list)
+
+    def run_current(_):
+        return score_all(main.spam_score_message, matcher)
+
+    same = run_reference(None) == run_current(None)
+    base = time_call(run_reference, None, args.repeat)
+    elapsed = time_call(run_current, None, args.repeat)
+    print(f"  reference {base * 1000:8.2f} ms")
+    print(f"  current   {elapsed * 1000:8.2f} ms  x{base / elapsed:5.1f}  {'same' if same else 'DIFF'}")
+
+
+def reference_extract_tickers(main, text, nicknames, exclude_set):
+    # fallback_extract_tickers as it was before TickerScanner.
+    counts = {}
+    for match in main.TICKER_SCAN_PATTERN.findall(text):
+        ticker = match.lstrip("$")
+        if exclude_set and ticker in exclude_set:
+            continue
+        if not main.TICKER_FORMAT_PATTERN.match(ticker):
+            continue
+        counts[ticker] = counts.get(ticker, 0) + 1
+    for ticker, names in nicknames.items():
+        if not ticker:
+            continue
+        tick = str(ticker).strip().upper()
+        if exclude_set and tick in exclude_set:
+            continue
+        if not main.TICKER_FORMAT_PATTERN.match(tick):
+            continue
+        if not isinstance(names, list):
+            continue
+        for name in names:
+            if not name:
+                continue
+            name_str = str(name)
+            if len(name_str) < 2 and not main.SHORT_NAME_SYMBOL_PATTERN.search(name_str):
+                continue
+            count = text.count(name_str)
+            if count:
+                counts[tick] = counts.get(tick, 0) + count
+    items = [{"ticker": t, "count": c, "sentiment": 0.0} for t, c in counts.items()]
+    items.sort(key=lambda x: x["count"], reverse=True)
+    return items
+
+
+def bench_tickers(args):
+    main = load_main()
+    _, exclude, matcher, nicknames = main.load_config()
+    exclude_set = {str(x).upper() for x in exclude if isinstance(x, str)}
+    # Synthetic tickers/nicknames show how counting scales with the dictionary size.
+    nicknames = dict(nicknames)
+    for i in range(args.extra_nicknames):
+        nicknames[f"ZZ{chr(65 + i // 26 % 26)}{chr(65 + i % 26)}"] = [f"\u30c0\u30df\u30fc{i}"]
+    # Same input analyze_market_data gets: the joined, filtered thread texts.
+    text = "\n".join(main.parse_dat_content(read_text(path), list(matcher)) for path in args.dats)
+    print(f"{len(text):,} chars, {sum(len(v) for v in nicknames.values())} nicknames")
+
+    if args.no_ahocorasick:
+        # What a default install (no pyahocorasick) runs: the regex pass.
+        main.get_ticker_scanner(nicknames, exclude_set)._automaton = None
+    same = reference_extract_tickers(main, text, nicknames, exclude_set) == main.fallback_extract_tickers(text, nicknames, exclude_set)
+    base = time_call(lambda t: reference_extract_tickers(main, t, nicknames, exclude_set), text, args.repeat)
+    elapsed = time_call(lambda t: main.fallback_extract_tickers(t, nicknames, exclude_set), text, args.repeat)
+    print(f"  reference {base * 1000:8.2f} ms")
+    print(f"  current   {elapsed * 1000:8.2f} ms  x{base / elapsed:5.1f}  {'same' if same else 'DIFF'}")
+
+
+def bench_parse(args):
+    main = load_main()
+    _, _, matcher, _ = main.load_config()
+    threads = [main.split_dat_lines(read_text(path)) for path in args.dats]
+    size = sum(len(line) for lines in threads for line in lines)
+    print(f"{len(threads)} threads, {sum(map(len, threads)):,} lines, {size:,} chars, {args.processes} processes")
+
+    def parse_all(_):
+        # Same shape as run_analysis: one fetch thread per DAT, parsing through offload_parse.
+        def parse_one(lines):
+            state = main.new_parse_state(matcher, main.TEXT_MODE_TAIL)
+            state, _ = main.offload_parse(main.parse_dat_chunk, sum(map(len, lines)), lines, matcher, state)
+            return main.render_parsed_text(state)
+        with ThreadPoolExecutor(max_workers=len(threads)) as executor:
+            return list(executor.map(parse_one, threads))
+
+    main.PARSE_PROCESSES = 0
+    expected = parse_all(None)
+    base = time_call(parse_all, None, args.repeat)
+
+    main.PARSE_PROCESSES = args.processes
+    main.PARSE_PROCESS_MIN_CHARS = 0
+    same = parse_all(None) == expected  # also spawns and warms up the workers
+    elapsed = time_call(parse_all, None, args.repeat)
+    print(f"  in-process {base * 1000:8.2f} ms")
+    print(f"  pool       {elapsed * 1000:8.2f} ms  x{base / elapsed:5.1f}  {'same' if same else 'DIFF'}")
+
+
+def topic_posts(main, paths):
+    # DAT files are split into cleaned posts; anything else (a saved prompt text) into lines.
+    posts = []
+    for path in paths:
+        text = read_text(path)
+        if "<>" in text:
+            posts.extend(msg for msg, _ in dat_posts(main, [path]))
+        else:
+            posts.extend(line for line in text.split("\n") if line.strip())
+    return posts
+
+
+def bench_topics(args):
+    main = load_main()
+    stopwords, _, _, _ = main.load_config()
+    stop_words = set(stopwords)
+    posts = topic_posts(main, args.inputs)
+    chars = sum(map(len, posts))
+    print(f"{len(posts):,} posts, {chars:,} chars")
+
+    def top50(backend):
+        counter = main.Counter()
+        for post in posts:
+            counter.update(w for w in main.topic_words(backend, post) if w not in stop_words)
+        return counter.most_common(50)
+
+    results = []
+    for name in topic_tokenizers.available_backends():
+        try:
+            backend = topic_tokenizers.get_backend(name)
+        except Exception as e:
+            print(f"  {name:<15} unavailable: {e}")
+            continue
+        top = top50(backend)  # also warms up dictionaries
+        elapsed = time_call(lambda _: top50(backend), None, args.repeat)
+        results.append((backend.name, elapsed, top))
+
+    reference = next((top for name, _, top in results if name == "janome"), results[0][2])
+    reference_words = {word for word, _ in reference}
+    for name, elapsed, top in results:
+        overlap = len(reference_words & {word for word, _ in top})
+        exact = len(set(reference) & set(top))
+        same = "same" if top == reference else f"{overlap}/50 words, {exact}/50 counts"
+        print(f"  {name:<15} {elapsed * 1000:9.1f} ms  {chars / elapsed / 1000:8.1f} kchars/s  {same}")
+
+
+def reference_topic_words(tokens, stop_words):
+    # analyze_topics' noun filter as it was before TopicFilter (Janome-style POS strings).
+    import re
+    words = []
+    for word, part_of_speech in tokens:
+        pos_parts = part_of_speech.split(',')
+        main_pos = pos_parts[0]
+        sub_pos = pos_parts[1]
+        if main_pos == '名詞' and sub_pos not in ['非自立', '代名詞', '数', '接尾']:
+            if word.isdigit() or len(word) < 2 or word in stop_words: continue
+            if re.search(r'[!-/:-@[-`{-~]', word): continue
+            if re.search(r'[！-／：-＠［-｀｛-～、-〜”’・％]', word): continue
+            if 'http' in word or '.com' in word: continue
+            words.append(word)
+    return words
+
+
+class ReplayBackend:
+    """Serves pre-tokenized posts so only the filter is timed."""
+
+    def __init__(self, name, tokenized, pos_tags):
+        self.name = name
+        self.tokenized = tokenized
+        self.pos_tags = pos_tags
+
+    def tokens(self, index):
+        return self.tokenized[index]
+
+
+def bench_topic_filter(args):
+    main = load_main()
+    stopwords, _, _, _ = main.load_config()
+    backend = topic_tokenizers.get_backend(args.backend)
+    posts = topic_posts(main, args.inputs)
+    tokenized = [list(backend.tokens(post)) for post in posts]
+    # The reference splits POS strings; give it the Janome-style string for every backend.
+    as_strings = [[(word, ",".join(backend.pos_tags(pos))) for word, pos in tokens] for tokens in tokenized]
+    print(f"{len(posts):,} posts, {sum(map(len, tokenized)):,} tokens ({backend.name})")
+
+    def run_reference(_):
+        stop_words = set(stopwords)
+        return main.Counter(w for tokens in as_strings for w in reference_topic_words(tokens, stop_words))
+
+    def run_current(_):
+        # A fresh filter per run, as after a config reload.
+        topic_filter = main.TopicFilter(stopwords)
+        replay = ReplayBackend(backend.name, tokenized, backend.pos_tags)
+        return topic_filter.count(topic_filter.words(replay, i) for i in range(len(posts)))
+
+    same = run_reference(None).most_common() == run_current(None).most_common()
+    base = time_call(run_reference, None, args.repeat)
+    elapsed = time_call(run_current, None, args.repeat)
+    print(f"  reference {base * 1000:8.2f} ms")
+    print(f"  current   {elapsed * 1000:8.2f} ms  x{base / elapsed:5.1f}  {'same' if same else 'DIFF'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for the local fetcher")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    html = sub.add_parser("html", help="HTML extraction backends over saved pages")
+    html.add_argument("pages", nargs="+", help="Saved HTML pages")
+    html.add_argument("--repeat", type=int, default=5)
+    html.set_defaults(func=bench_html)
+
+    spam = sub.add_parser("spam", help="spam scoring over saved DAT files")
+    spam.add_argument("dats", nargs="+", help="Saved DAT files (CP932 or UTF-8)")
+    spam.add_argument("--repeat", type=int, default=5)
+    spam.add_argument("--extra-terms", type=int, default=0, help="Pad the spam list with N synthetic terms")
+    spam.set_defaults(func=bench_spam)
+
+    tickers = sub.add_parser("tickers", help="fallback ticker/nickname counting over saved DAT files")
+    tickers.add_argument("dats", nargs="+", help="Saved DAT files (CP932 or UTF-8)")
+    tickers.add_argument("--repeat", type=int, default=5)
+    tickers.add_argument("--extra-nicknames", type=int, default=0, help="Pad the dictionary with N synthetic nicknames")
+    tickers.add_argument("--no-ahocorasick", action="store_true", help="Time the regex fallback even if pyahocorasick is installed")
+    tickers.set_defaults(func=bench_tickers)
+
+    parse = sub.add_parser("parse", help="DAT parsing in-process vs the parse process pool")
+    parse.add_argument("dats", nargs="+", help="Saved DAT files (CP932 or UTF-8)")
+    parse.add_argument("--repeat", type=int, default=3)
+    parse.add_argument("--processes", type=int, default=os.cpu_count() or 2)
+    parse.set_defaults(func=bench_parse)
+
+    topics = sub.add_parser("topics", help="topic tokenizer backends over saved DATs or prompt text")
+    topics.add_argument("inputs", nargs="+", help="Saved DAT files or text files with one post per line")
+    topics.add_argument("--repeat", type=int, default=3)
+    topics.set_defaults(func=bench_topics)
+
+    topic_filter = sub.add_parser("topic-filter", help="topic noun filter alone over pre-tokenized posts")
+    topic_filter.add_argument("inputs", nargs="+", help="Saved DAT files or text files with one post per line")
+    topic_filter.add_argument("--repeat", type=int, default=5)
+    topic_filter.add_argument("--backend", default="janome", choices=sorted(topic_tokenizers.BACKENDS))
+    topic_filter.set_defaults(func=bench_topic_filter)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -5,9 +5,10 @@ import os
 import sys
 from typing import Any, Dict, List, Optional, Tuple
 
-import requests
 from dotenv import load_dotenv
 
+import http_client
+
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 DEFAULT_OUT = os.path.join(BASE_DIR, "finnhub_calendar.json")
 BASE_URL = "https://finnhub.io/api/v1"
@@ -40,7 +41,7 @@ def build_range(from_arg: Optional[str], to_arg: Optional[str], days: int) -> Tu
 
 
 def fetch_json(url: str, params: Dict[str, Any]) -> Dict[str, Any]:
-    resp = requests.get(url, params=params, timeout=30)
+    resp = http_client.get(url, retry=http_client.API_RETRY, params=params, timeout=30)
     resp.raise_for_status()
     data = resp.json()
     return data if isinstance(data, dict) else {}
@@ -0,0 +1,155 @@
+"""
+HTML extraction backends for the local fetcher scripts.
+
+Only two things are ever pulled out of scraped pages: the post bodies of a
+5ch read.cgi page (the DAT fallback) and the visible text of a page that is
+then searched with regexes (IndexMood breadth). Both are served here by the
+fastest parser that is installed: selectolax, then lxml, then BeautifulSoup
+with the pure-Python html.parser. HTML_PARSER_BACKEND forces one of
+"selectolax", "lxml" or "bs4".
+
+Every backend returns the same strings BeautifulSoup would:
+message_texts() matches el.get_text(strip=True) and page_text() matches
+" ".join(soup.stripped_strings) (script/style/template text and comments
+are skipped).
+"""
+import logging
+import os
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml.html
+    from lxml import etree
+except ImportError:
+    lxml = None
+    etree = None
+
+# read.cgi layouts seen so far, newest first.
+THREAD_MESSAGE_SELECTORS = ("div.message", "dd.thread_in", "div.post > div.message")
+NON_TEXT_TAGS = ("script", "style", "template")
+# Same selectors as XPath, so lxml does not need the cssselect package.
+_HAS_CLASS = 'contains(concat(" ", normalize-space(@class), " "), " {} ")'
+THREAD_MESSAGE_XPATHS = (
+    f"//div[{_HAS_CLASS.format('message')}]",
+    f"//dd[{_HAS_CLASS.format('thread_in')}]",
+    f"//div[{_HAS_CLASS.format('post')}]/div[{_HAS_CLASS.format('message')}]",
+)
+
+
+def _strip_join(strings, separator):
+    return separator.join(s for s in (s.strip() for s in strings) if s)
+
+
+class Bs4Backend:
+    name = "bs4"
+
+    def message_texts(self, html):
+        soup = BeautifulSoup(html, "html.parser")
+        for selector in THREAD_MESSAGE_SELECTORS:
+            msgs = soup.select(selector)
+            if msgs:
+                return [msg.get_text(strip=True) for msg in msgs]
+        return []
+
+    def page_text(self, html):
+        soup = BeautifulSoup(html, "html.parser")
+        return " ".join(soup.stripped_strings)
+
+
+class LxmlBackend:
+    name = "lxml"
+
+    def _parse(self, html):
+        root = lxml.html.document_fromstring(html)
+        etree.strip_elements(root, etree.Comment, *NON_TEXT_TAGS, with_tail=False)
+        return root
+
+    def message_texts(self, html):
+        if not html.strip():
+            return []
+        root = self._parse(html)
+        for xpath in THREAD_MESSAGE_XPATHS:
+            msgs = root.xpath(xpath)
+            if msgs:
+                return [_strip_join(msg.itertext(), "") for msg in msgs]
+        return []
+
+    def page_text(self, html):
+        if not html.strip():
+            return ""
+        return _strip_join(self._parse(html).itertext(), " ")
+
+
+class SelectolaxBackend:
+    name = "selectolax"
+
+    def _parse(self, html):
+        tree = HTMLParser(html)
+        tree.strip_tags(list(NON_TEXT_TAGS))
+        return tree
+
+    def _text_nodes(self, node):
+        for child in node.traverse(include_text=True):
+            if child.tag == "-text":
+                yield child.text_content or ""
+
+    def message_texts(self, html):
+        tree = self._parse(html)
+        for selector in THREAD_MESSAGE_SELECTORS:
+            msgs = tree.css(selector)
+            if msgs:
+                return [_strip_join(self._text_nodes(msg), "") for msg in msgs]
+        return []
+
+    def page_text(self, html):
+        tree = self._parse(html)
+        if tree.root is None:
+            return ""
+        return _strip_join(self._text_nodes(tree.root), " ")
+
+
+BACKENDS = {
+    "selectolax": (SelectolaxBackend, lambda: HTMLParser is not None),
+    "lxml": (LxmlBackend, lambda: lxml is not None),
+    "bs4": (Bs4Backend, lambda: True),
+}
+_BACKEND = None
+
+
+def available_backends():
+    return [name for name, (_, usable) in BACKENDS.items() if usable()]
+
+
+def get_backend(name=None):
+    """Return the named backend, or the preferred installed one."""
+    global _BACKEND
+    if name:
+        backend_cls, usable = BACKENDS[name]
+        if not usable():
+            raise RuntimeError(f"HTML backend not installed: {name}")
+        return backend_cls()
+    if _BACKEND is None:
+        forced = os.getenv("HTML_PARSER_BACKEND", "").strip().lower()
+        names = available_backends()
+        if forced and forced not in names:
+            logging.warning(f"HTML_PARSER_BACKEND={forced} unavailable, using {names[0]}")
+            forced = ""
+        _BACKEND = BACKENDS[forced or names[0]][0]()
+    return _BACKEND
+
+
+def message_texts(html):
+    return get_backend().message_texts(html)
+
+
+def page_text(html):
+    return get_backend().page_text(html)
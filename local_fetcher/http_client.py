@@ -0,0 +1,148 @@
+"""
+Shared HTTP client for the local fetcher scripts.
+
+Every host gets one keep-alive requests.Session with a tuned connection pool,
+so repeated calls (FRED series, Gemini, 5ch DATs, ...) reuse TCP/TLS
+connections instead of paying a new handshake each time. Retries follow the
+named RetryPolicy objects below, and every request is timed per host.
+"""
+import logging
+import os
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "8"))
+DEFAULT_TIMEOUT = 10
+
+
+class RetryPolicy:
+    """How often to try a request and how long to wait between attempts."""
+
+    def __init__(self, attempts=1, delay=0.0, multiplier=1.0, retry_status=None):
+        self.attempts = max(int(attempts), 1)
+        self.delay = float(delay)
+        self.multiplier = float(multiplier)
+        self.retry_status = retry_status or (lambda code: False)
+
+    def wait_time(self, attempt):
+        return self.delay * (self.multiplier ** attempt)
+
+    def replace(self, attempts=None, delay=None):
+        return RetryPolicy(
+            attempts=self.attempts if attempts is None else attempts,
+            delay=self.delay if delay is None else delay,
+            multiplier=self.multiplier,
+            retry_status=self.retry_status
+        )
+
+
+# Single attempt; exceptions propagate like a plain requests call.
+NO_RETRY = RetryPolicy()
+# Scraped pages: anything but 200 is retried after a fixed pause.
+PAGE_RETRY = RetryPolicy(attempts=3, delay=2.0, retry_status=lambda code: code != 200)
+# JSON APIs: retry rate limits and server errors with exponential backoff.
+API_RETRY = RetryPolicy(attempts=3, delay=2.0, multiplier=2.0, retry_status=lambda code: code >= 500 or code == 429)
+# Worker ingest: same statuses, slower backoff (5s, 10s).
+UPLOAD_RETRY = RetryPolicy(attempts=3, delay=5.0, multiplier=2.0, retry_status=lambda code: code >= 500 or code == 429)
+
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+_LATENCY = {}
+_LATENCY_LOCK = threading.Lock()
+
+
+def host_key(url):
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}"
+
+
+def redact_url(url):
+    # Query strings carry API keys (Gemini, FRED); never log them.
+    parsed = urlparse(url)
+    return f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
+
+
+def new_session():
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url):
+    key = host_key(url)
+    with _SESSIONS_LOCK:
+        session = _SESSIONS.get(key)
+        if session is None:
+            session = new_session()
+            _SESSIONS[key] = session
+    return session
+
+
+def record_latency(url, elapsed, failed=False):
+    key = urlparse(url).netloc
+    with _LATENCY_LOCK:
+        stats = _LATENCY.setdefault(key, {"count": 0, "errors": 0, "total": 0.0, "max": 0.0})
+        stats["count"] += 1
+        stats["total"] += elapsed
+        stats["max"] = max(stats["max"], elapsed)
+        if failed:
+            stats["errors"] += 1
+
+
+def get_latency_stats():
+    with _LATENCY_LOCK:
+        return {host: dict(stats) for host, stats in _LATENCY.items()}
+
+
+def reset_latency_stats():
+    with _LATENCY_LOCK:
+        _LATENCY.clear()
+
+
+def request(method, url, retry=NO_RETRY, session=None, **kwargs):
+    """
+    Send a request through the pooled session for the URL's host.
+    Returns the last response once it is acceptable or retries are exhausted.
+    If no attempt produced a response, the last exception is re-raised.
+    """
+    kwargs.setdefault("timeout", DEFAULT_TIMEOUT)
+    client = session or get_session(url)
+    last_resp = None
+    last_error = None
+    for attempt in range(retry.attempts):
+        started = time.perf_counter()
+        try:
+            resp = client.request(method, url, **kwargs)
+        except Exception as e:
+            record_latency(url, time.perf_counter() - started, failed=True)
+            last_error = e
+            if retry.attempts > 1:
+                logging.warning(f"HTTP {method} {redact_url(url)} attempt {attempt + 1} error: {e}")
+        else:
+            record_latency(url, time.perf_counter() - started, failed=resp.status_code >= 400)
+            last_resp = resp
+            if not retry.retry_status(resp.status_code):
+                return resp
+            logging.warning(f"HTTP {method} {redact_url(url)} attempt {attempt + 1} failed: Status {resp.status_code}")
+
+        if attempt < retry.attempts - 1:
+            time.sleep(retry.wait_time(attempt))
+
+    if last_resp is None and last_error is not None:
+        raise last_error
+    return last_resp
+
+
+def get(url, retry=NO_RETRY, **kwargs):
+    return request("GET", url, retry=retry, **kwargs)
+
+
+def post(url, retry=NO_RETRY, **kwargs):
+    return request("POST", url, retry=retry, **kwargs)
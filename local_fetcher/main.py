@@ -1,5 +1,6 @@
 import re
 import math
+import asyncio
 import os
 import sys
 import json
@@ -9,15 +10,31 @@ import time
 import logging
 import datetime
 import glob
+import gzip
+import hashlib
+import mmap
+import shutil
+import threading
+import multiprocessing
+from array import array
 from collections import Counter
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+from urllib.parse import urlparse
 from dotenv import load_dotenv
 
+import http_client
+import html_extract
+import topic_tokenizers
+
 # Base Directory Setup
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 LOG_DIR = os.path.join(BASE_DIR, "logs")
 CACHE_DIR = os.path.join(BASE_DIR, "dat_cache")
+DAT_INDEX_FILE = os.path.join(CACHE_DIR, "index.json")
+HTTP_META_FILE = os.path.join(CACHE_DIR, "http_meta.json")
+TOPIC_TOKEN_CACHE_FILE = os.path.join(CACHE_DIR, "topic_tokens.json")
+TOPIC_TREND_FILE = os.path.join(CACHE_DIR, "topic_trends.json")
 
 # Setup Logging
 os.makedirs(LOG_DIR, exist_ok=True)
@@ -46,6 +63,62 @@ SPAM_SCORE_THRESHOLD = int(os.getenv("SPAM_SCORE_THRESHOLD", "6"))
 SPAM_DUP_THRESHOLD = int(os.getenv("SPAM_DUP_THRESHOLD", "2"))
 SPAM_ID_LIMIT = int(os.getenv("SPAM_ID_LIMIT", "25"))
 LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "30"))
+EXTERNAL_FETCH_BUDGET = float(os.getenv("EXTERNAL_FETCH_BUDGET", "60"))
+EXTERNAL_FETCH_WORKERS = int(os.getenv("EXTERNAL_FETCH_WORKERS", "12"))
+FETCH_HOST_CONCURRENCY = int(os.getenv("FETCH_HOST_CONCURRENCY", "2"))
+FETCH_RATE_PER_SEC = float(os.getenv("FETCH_RATE_PER_SEC", "1.0"))
+FETCH_RATE_BURST = int(os.getenv("FETCH_RATE_BURST", "2"))
+DAT_FINISHED_LINES = 995
+# 0 keeps all parsing in-process; N > 0 parses large DAT/HTML inputs in N worker processes.
+PARSE_PROCESSES = int(os.getenv("PARSE_PROCESSES", "0"))
+PARSE_PROCESS_MIN_CHARS = int(os.getenv("PARSE_PROCESS_MIN_CHARS", "65536"))
+# 0 tokenizes topics in-process; N > 0 shards posts not in the topic token cache over N workers.
+TOPIC_PROCESSES = int(os.getenv("TOPIC_PROCESSES", "0"))
+TOPIC_PROCESS_MIN_POSTS = int(os.getenv("TOPIC_PROCESS_MIN_POSTS", "200"))
+PARSED_CACHE_VERSION = 6
+DAT_TEXT_BUDGET = 15000
+HTML_TEXT_BUDGET = 30000
+TEXT_MODE_HEAD = "head"
+TEXT_MODE_TAIL = "tail"
+# Keep every post and pick the highest-signal ones (replies received, ticker mentions) per budget.
+TEXT_MODE_SCORE = "score"
+TEXT_MODES = (TEXT_MODE_HEAD, TEXT_MODE_TAIL, TEXT_MODE_SCORE)
+THREAD_TEXT_MODE = os.getenv("THREAD_TEXT_MODE", "").strip().lower()
+DEFAULT_WINDOW = "24h"
+WINDOW_SINCE_LAST = "since-last"
+THREAD_WINDOW = os.getenv("THREAD_WINDOW", DEFAULT_WINDOW).strip().lower()
+JST = datetime.timezone(datetime.timedelta(hours=9))
+DAT_STORE_VERSION = 3
+TOPIC_TOKEN_CACHE_VERSION = 1
+TOPIC_TREND_VERSION = 2
+# Trending topics: rate over the last TREND_RECENT_HOURS vs the TREND_BASELINE_HOURS before them.
+TREND_RECENT_HOURS = int(os.getenv("TREND_RECENT_HOURS", "2"))
+TREND_BASELINE_HOURS = int(os.getenv("TREND_BASELINE_HOURS", "24"))
+# Per-hour pseudo-count added to both rates, so rare words need real volume to trend.
+TREND_SMOOTHING = float(os.getenv("TREND_SMOOTHING", "1.0"))
+TREND_SURGE_RATIO = float(os.getenv("TREND_SURGE_RATIO", "2.0"))
+TREND_MIN_COUNT = int(os.getenv("TREND_MIN_COUNT", "5"))
+NEAR_DUP_MAX_DISTANCE = int(os.getenv("NEAR_DUP_MAX_DISTANCE", "8"))
+NEAR_DUP_MIN_CHARS = int(os.getenv("NEAR_DUP_MIN_CHARS", "20"))
+SIGNAL_REPLY_WEIGHT = float(os.getenv("SIGNAL_REPLY_WEIGHT", "1"))
+SIGNAL_TICKER_WEIGHT = float(os.getenv("SIGNAL_TICKER_WEIGHT", "2"))
+# Share of a thread's budget that posts with no replies and no ticker may fill in score mode.
+SIGNAL_CHATTER_SHARE = float(os.getenv("SIGNAL_CHATTER_SHARE", "0.5"))
+# Each model variant gets thread text up to its own input limit. PROMPT_TEXT_BUDGET
+# optionally caps both (e.g. to bound token cost); off by default, since any cap
+# below GEMINI_FALLBACK_INPUT_CHARS gives both variants the same text.
+PROMPT_TEXT_BUDGET = int(os.getenv("PROMPT_TEXT_BUDGET", "0"))
+GEMINI_MAX_INPUT_CHARS = int(os.getenv("GEMINI_MAX_INPUT_CHARS", "300000"))
+GEMINI_FALLBACK_INPUT_CHARS = int(os.getenv("GEMINI_FALLBACK_INPUT_CHARS", "180000"))
+THREAD_WEIGHT_BASE = 0.25
+THREAD_RECENCY_HALF_LIFE = float(os.getenv("THREAD_RECENCY_HALF_LIFE_HOURS", "6")) * 3600
+THREAD_VELOCITY_WINDOW = 3600
+# Anchor ranges wider than this (">>1-1000") are not replies to individual posts.
+ANCHOR_RANGE_MAX = 10
+DAT_CACHE_BUDGET_BYTES = int(float(os.getenv("DAT_CACHE_BUDGET_MB", "512")) * 1024 * 1024)
+DAT_REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+}
 
 if not GEMINI_API_KEY:
     logging.error("GEMINI_API_KEY is not set.")
@@ -67,22 +140,76 @@ SPAM_REPEAT_PATTERN = re.compile(r"(.)\1{8,}")
 SPAM_NOISE_PATTERN = re.compile(r"[!\uFF01?\uFF1Fw\uFF57]{6,}")
 SPAM_URL_PATTERN = re.compile(r"https?://")
 SPAM_MEANINGFUL_PATTERN = re.compile(r"[A-Za-z0-9?-??-??-?]")
+DAT_DATE_PATTERN = re.compile(r"(\d{4})/(\d{1,2})/(\d{1,2})\([^)]*\)\s*(\d{1,2}):(\d{2}):(\d{2})(?:\.(\d{1,6}))?")
+WINDOW_SPEC_PATTERN = re.compile(r"^(\d+)\s*([mh])$")
+# ">>12", ">>12-15", ">>3,5" and the full-width variants; HTML anchors are already unescaped by clean_message().
+ANCHOR_PATTERN = re.compile(r"(?:>>|\uFF1E\uFF1E|\u226B)\s*([0-9\uFF10-\uFF19]{1,4}(?:\s*[-\uFF0D,\u3001]\s*[0-9\uFF10-\uFF19]{1,4})*)")
+ANCHOR_PART_PATTERN = re.compile(r"([0-9\uFF10-\uFF19]+)(?:\s*[-\uFF0D]\s*([0-9\uFF10-\uFF19]+))?")
+# Half-width and full-width symbols (including ～, ：, ”, ％) that disqualify a topic word.
+TOPIC_SYMBOL_PATTERN = re.compile(r'[!-/:-@[-`{-~！-／：-＠［-｀｛-～、-〜”’・％]')
+TOPIC_SKIP_SUB_POS = frozenset(['非自立', '代名詞', '数', '接尾'])
+TOPIC_WORD_CACHE_MAX = 200000
 SPAM_TICKER_HINT_PATTERN = re.compile(r"\$[A-Za-z]{1,5}\b|\b[A-Z]{2,5}\b")
 
-_JANOME_TOKENIZER = None
+_TOPIC_TOKEN_CACHE = None
+_TOPIC_TRENDS = None
+_DAT_INDEX = None
+_THREAD_PARSE_STATES = {}
+_HTTP_META = None
+_HTTP_CACHE_STATS = {}
+_SUBJECT_THREADS = None
+_LAST_WINDOW_END = None
+_EXTERNAL_LAST_GOOD = {}
+_CACHE_LOCK = threading.RLock()
+_HOST_LIMITERS = {}
+_HOST_LIMITERS_LOCK = threading.Lock()
+_PARSE_POOL = None
+_PARSE_POOL_LOCK = threading.Lock()
+_PARSE_STATS = {"pool": 0, "inline": 0}
+_TOPIC_POOL = None
+
+class TokenBucket:
+    """Thread-safe token bucket: refills `rate` tokens per second up to `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = max(float(capacity), 1.0)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1.0:
+                    self.tokens -= 1.0
+                    return
+                wait = (1.0 - self.tokens) / self.rate
+            time.sleep(wait)
+
+@contextmanager
+def host_slot(url):
+    """Hold one of the host's concurrent slots and spend one rate-limit token."""
+    host = urlparse(url).netloc
+    with _HOST_LIMITERS_LOCK:
+        limiter = _HOST_LIMITERS.get(host)
+        if limiter is None:
+            limiter = (
+                threading.BoundedSemaphore(max(FETCH_HOST_CONCURRENCY, 1)),
+                TokenBucket(FETCH_RATE_PER_SEC, FETCH_RATE_BURST)
+            )
+            _HOST_LIMITERS[host] = limiter
+    semaphore, bucket = limiter
+    with semaphore:
+        bucket.acquire()
+        yield
 
 def cleanup_old_files():
-    # Cleanup Cache (Keep top 20)
-    if os.path.exists(CACHE_DIR):
-        files = [os.path.join(CACHE_DIR, f) for f in os.listdir(CACHE_DIR) if f.endswith(".dat")]
-        if len(files) > 20:
-            files.sort(key=os.path.getmtime, reverse=True)
-            for f in files[20:]:
-                try:
-                    os.remove(f)
-                    logging.info(f"Cleaned up old cache: {os.path.basename(f)}")
-                except Exception as e:
-                    logging.warning(f"Failed to remove cache {f}: {e}")
+    # Cleanup Cache (LRU within the byte budget, driven by the manifest)
+    evict_dat_cache()
 
     # Cleanup Logs (Keep 1 month)
     now = time.time()
@@ -119,20 +246,87 @@ def load_config():
         except Exception as e:
             logging.warning(f"Failed to load nickname_dictionary.json: {e}")
 
-    return stopwords, exclude, spam, nicknames
+    return stopwords, exclude, SpamMatcher(spam), nicknames
+
+def load_http_meta():
+    global _HTTP_META
+    with _CACHE_LOCK:
+        if _HTTP_META is None:
+            _HTTP_META = {}
+            if os.path.exists(HTTP_META_FILE):
+                try:
+                    with open(HTTP_META_FILE, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                    if isinstance(data, dict):
+                        _HTTP_META = data
+                except Exception as e:
+                    logging.warning(f"Failed to load http meta: {e}")
+    return _HTTP_META
+
+def save_http_meta():
+    if _HTTP_META is None:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with _CACHE_LOCK:
+            tmp_path = HTTP_META_FILE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(_HTTP_META, f, ensure_ascii=False)
+            os.replace(tmp_path, HTTP_META_FILE)
+    except Exception as e:
+        logging.warning(f"Failed to save http meta: {e}")
+
+def conditional_get(url, headers=None, timeout=10, label="http", use_validators=True):
+    """
+    GET with the stored ETag / Last-Modified validators.
+    A 304 response means the caller's cached copy is current; its body is empty
+    and must not be decoded or parsed. Only pass use_validators=True when the
+    caller actually holds a cached copy to fall back on.
+    """
+    meta = load_http_meta()
+    send_headers = dict(headers or {})
+    cached = meta.get(url) if use_validators else None
+    if cached:
+        if cached.get("etag"):
+            send_headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            send_headers["If-Modified-Since"] = cached["last_modified"]
+
+    with host_slot(url):
+        resp = http_client.get(url, headers=send_headers, timeout=timeout)
+    with _CACHE_LOCK:
+        stats = _HTTP_CACHE_STATS.setdefault(label, {"hit": 0, "miss": 0})
+        if resp.status_code == 304:
+            stats["hit"] += 1
+            return resp
+
+        stats["miss"] += 1
+        if resp.status_code in (200, 206):
+            etag = resp.headers.get("ETag")
+            last_modified = resp.headers.get("Last-Modified")
+            if etag or last_modified:
+                meta[url] = {"etag": etag, "last_modified": last_modified}
+            else:
+                meta.pop(url, None)
+            save_http_meta()
+    return resp
 
 def discover_threads():
+    global _SUBJECT_THREADS
     logging.info("Discovering latest threads from 5ch...")
     subject_url = "https://egg.5ch.net/stock/subject.txt"
     try:
-        resp = requests.get(subject_url, timeout=10)
+        resp = conditional_get(subject_url, timeout=10, label="subject", use_validators=_SUBJECT_THREADS is not None)
+        if resp.status_code == 304:
+            logging.info("subject.txt not modified. Reusing thread list.")
+            return list(_SUBJECT_THREADS)
         resp.encoding = "CP932"
         text = resp.text
     except Exception as e:
         logging.error(f"Failed to fetch subject.txt: {e}")
         return []
 
-    pattern = re.compile(r"(\d+)\.dat<>(.*【まとめ】米国株やってる人の溜まり場\s*(\d+).*)\s+\(\d+\)")
+    pattern = re.compile(r"(\d+)\.dat<>(.*【まとめ】米国株やってる人の溜まり場\s*(\d+).*)\s+\((\d+)\)")
     
     candidates = []
     for line in text.splitlines():
@@ -141,15 +335,17 @@ def discover_threads():
             dat_id = m.group(1)
             title = m.group(2)
             thread_num = int(m.group(3))
+            res_count = int(m.group(4))
             url = f"https://egg.5ch.net/test/read.cgi/stock/{dat_id}/"
-            candidates.append({"name": title, "url": url, "num": thread_num})
+            candidates.append({"name": title, "url": url, "num": thread_num, "res": res_count})
     
     candidates.sort(key=lambda x: x["num"], reverse=True)
     top_threads = candidates[:5]
     for t in top_threads:
         logging.info(f"Found: {t['name']} (No.{t['num']})")
-        
-    return top_threads
+
+    _SUBJECT_THREADS = top_threads
+    return list(top_threads)
 
 def extract_post_id(meta_text):
     if not meta_text:
@@ -379,7 +575,7 @@ def repair_json_with_gemini(raw_text, model_name="gemini-2.5-flash-lite"):
     }
 
     try:
-        resp = requests.post(url, headers=headers, json=payload, timeout=60)
+        resp = http_client.post(url, headers=headers, json=payload, timeout=60)
         if resp.status_code != 200:
             return None
         result = resp.json()
@@ -431,41 +627,165 @@ def normalize_ticker_items(items, exclude_set):
 
     return output
 
-def fallback_extract_tickers(text, nicknames, exclude_set):
-    if not text:
-        return []
+def trie_pattern(node):
+    """Regex source matching any word of a {char: child, "": word} trie, one branch per char."""
+    branches = [re.escape(ch) + trie_pattern(child) for ch, child in sorted(node.items()) if ch]
+    if not branches:
+        return ""
+    body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+    return f"(?:{body})?" if "" in node else body
 
-    counts = {}
-    for match in TICKER_SCAN_PATTERN.findall(text):
-        ticker = match.lstrip("$")
-        if exclude_set and ticker in exclude_set:
-            continue
-        if not TICKER_FORMAT_PATTERN.match(ticker):
-            continue
-        counts[ticker] = counts.get(ticker, 0) + 1
+class TickerScanner:
+    """
+    Counts cashtag/uppercase tickers and dictionary nicknames in one scanner
+    built once per (nickname dictionary, exclude set). Nicknames go through a
+    single Aho-Corasick pass when pyahocorasick is installed, otherwise a
+    single pass of one compiled trie regex. Counts match the old
+    per-nickname text.count(): non-overlapping per nickname, and a nickname
+    shared by several tickers counts for each of them.
+    """
 
-    if isinstance(nicknames, dict):
-        for ticker, names in nicknames.items():
-            if not ticker:
-                continue
-            tick = str(ticker).strip().upper()
-            if exclude_set and tick in exclude_set:
-                continue
-            if not TICKER_FORMAT_PATTERN.match(tick):
-                continue
-            if not isinstance(names, list):
-                continue
-            for name in names:
-                if not name:
+    def __init__(self, nicknames, exclude_set):
+        self.exclude_set = frozenset(exclude_set or ())
+        self.ticker_order = []
+        self.names = {}
+        if isinstance(nicknames, dict):
+            for ticker, names in nicknames.items():
+                if not ticker:
+                    continue
+                tick = str(ticker).strip().upper()
+                if tick in self.exclude_set:
                     continue
-                name_str = str(name)
-                if len(name_str) < 2 and not SHORT_NAME_SYMBOL_PATTERN.search(name_str):
+                if not TICKER_FORMAT_PATTERN.match(tick):
                     continue
-                count = text.count(name_str)
-                if count:
-                    counts[tick] = counts.get(tick, 0) + count
+                if not isinstance(names, list):
+                    continue
+                for name in names:
+                    if not name:
+                        continue
+                    name_str = str(name)
+                    if len(name_str) < 2 and not SHORT_NAME_SYMBOL_PATTERN.search(name_str):
+                        continue
+                    self.names.setdefault(name_str, []).append(tick)
+                    if tick not in self.ticker_order:
+                        self.ticker_order.append(tick)
+        self._token_cache = {}
+        self._automaton = None
+        self._name_pattern = None
+        self._name_trie = {}
+        if self.names:
+            try:
+                import ahocorasick
+                automaton = ahocorasick.Automaton()
+                for name_str in self.names:
+                    automaton.add_word(name_str, name_str)
+                automaton.make_automaton()
+                self._automaton = automaton
+            except ImportError:
+                pass
+            # Without pyahocorasick: a trie-shaped regex (a flat alternation backtracks
+            # through every name at every char) finds each position where some
+            # nickname starts, then a walk down the same trie yields all names there.
+            for name_str in self.names:
+                node = self._name_trie
+                for ch in name_str:
+                    node = node.setdefault(ch, {})
+                node[""] = name_str
+            self._name_pattern = re.compile(f"(?={trie_pattern(self._name_trie)})")
+
+    def _ticker_for_token(self, token):
+        ticker = self._token_cache.get(token, "")
+        if ticker == "":
+            ticker = token.lstrip("$")
+            if ticker in self.exclude_set or not TICKER_FORMAT_PATTERN.match(ticker):
+                ticker = None
+            self._token_cache[token] = ticker
+        return ticker
+
+    def _nickname_matches(self, text):
+        """Yield (start, name) for every non-overlapping occurrence of each nickname."""
+        if self._automaton is not None:
+            next_start = {}
+            for end, name_str in self._automaton.iter(text):
+                start = end - len(name_str) + 1
+                if start >= next_start.get(name_str, 0):
+                    next_start[name_str] = end + 1
+                    yield start, name_str
+            return
+        if self._name_pattern is None:
+            return
+        next_start = {}
+        end = len(text)
+        for match in self._name_pattern.finditer(text):
+            start = pos = match.start()
+            node = self._name_trie
+            while pos < end and text[pos] in node:
+                node = node[text[pos]]
+                pos += 1
+                name_str = node.get("")
+                if name_str is not None and start >= next_start.get(name_str, 0):
+                    next_start[name_str] = pos
+                    yield start, name_str
+
+    def mentions(self, text):
+        """True if the text names at least one ticker or nickname; stops at the first hit."""
+        if not text:
+            return False
+        for match in TICKER_SCAN_PATTERN.finditer(text):
+            if self._ticker_for_token(match.group()) is not None:
+                return True
+        for _ in self._nickname_matches(text):
+            return True
+        return False
+
+    def scan(self, text):
+        """Return {ticker: {"count": n, "positions": [...]}} for the text."""
+        results = {}
+        if not text:
+            return results
+        for match in TICKER_SCAN_PATTERN.finditer(text):
+            ticker = self._ticker_for_token(match.group())
+            if ticker is None:
+                continue
+            hit = results.setdefault(ticker, {"count": 0, "positions": []})
+            hit["count"] += 1
+            hit["positions"].append(match.start())
+
+        nick_hits = {}
+        for start, name_str in self._nickname_matches(text):
+            for tick in self.names[name_str]:
+                nick_hits.setdefault(tick, []).append(start)
+        # Nickname tickers follow dictionary order, as the old per-name loop did.
+        for tick in self.ticker_order:
+            positions = nick_hits.get(tick)
+            if not positions:
+                continue
+            hit = results.setdefault(tick, {"count": 0, "positions": []})
+            hit["count"] += len(positions)
+            hit["positions"].extend(positions)
+            hit["positions"].sort()
+        return results
+
+_TICKER_SCANNERS = {}
+
+def get_ticker_scanner(nicknames, exclude_set):
+    nick_key = json.dumps(nicknames, ensure_ascii=False) if isinstance(nicknames, dict) else ""
+    key = (nick_key, frozenset(exclude_set or ()))
+    scanner = _TICKER_SCANNERS.get(key)
+    if scanner is None:
+        scanner = TickerScanner(nicknames, exclude_set)
+        _TICKER_SCANNERS[key] = scanner
+    return scanner
+
+def scan_tickers(text, nicknames, exclude_set):
+    return get_ticker_scanner(nicknames, exclude_set).scan(text)
+
+def fallback_extract_tickers(text, nicknames, exclude_set):
+    if not text:
+        return []
 
-    items = [{"ticker": t, "count": c, "sentiment": 0.0} for t, c in counts.items()]
+    counts = scan_tickers(text, nicknames, exclude_set)
+    items = [{"ticker": t, "count": hit["count"], "sentiment": 0.0} for t, hit in counts.items()]
     items.sort(key=lambda x: x["count"], reverse=True)
     return items
 
@@ -483,16 +803,88 @@ def build_brief_from_tickers(tickers, headline, mode="swing"):
     base = {"headline": headline, "watchlist": seeds}
     return sanitize_brief(base, mode=mode)
 
+class SpamMatcher:
+    """
+    Finds any configured spam term in one pass over a message.
+    Uses an Aho-Corasick automaton when pyahocorasick is installed, otherwise
+    a single regex alternation. Iterates like the original term list, so it
+    can be used wherever the list (or its tuple as a cache key) was.
+    """
+
+    def __init__(self, terms=()):
+        self.terms = tuple(terms)
+        words = sorted({t for t in self.terms if t}, key=len, reverse=True)
+        self._automaton = None
+        self._pattern = None
+        if not words:
+            return
+        try:
+            import ahocorasick
+            automaton = ahocorasick.Automaton()
+            for word in words:
+                automaton.add_word(word, word)
+            automaton.make_automaton()
+            self._automaton = automaton
+        except ImportError:
+            self._pattern = re.compile("|".join(re.escape(word) for word in words))
+
+    def __iter__(self):
+        return iter(self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+    def search(self, message):
+        if self._automaton is not None:
+            for _ in self._automaton.iter(message):
+                return True
+            return False
+        if self._pattern is not None:
+            return self._pattern.search(message) is not None
+        return False
+
+_SPAM_MATCHERS = {}
+
+def get_spam_matcher(spam_list):
+    if isinstance(spam_list, SpamMatcher):
+        return spam_list
+    key = tuple(spam_list or ())
+    matcher = _SPAM_MATCHERS.get(key)
+    if matcher is None:
+        matcher = SpamMatcher(key)
+        _SPAM_MATCHERS[key] = matcher
+    return matcher
+
+def spam_features(message):
+    """
+    Content features used by spam_score_message, computed together.
+    Returns (length, repeat, noise, url, compact_len, meaningful). The URL
+    regex only runs when "://" is present, and the whitespace-free copy is
+    only built when the meaningful-ratio check can apply (> 10 chars).
+    """
+    length = len(message)
+    repeat = SPAM_REPEAT_PATTERN.search(message) is not None
+    noise = SPAM_NOISE_PATTERN.search(message) is not None
+    url = "://" in message and SPAM_URL_PATTERN.search(message) is not None
+
+    compact_len = length
+    meaningful = 0
+    if length > 10:
+        compact = WHITESPACE_PATTERN.sub("", message)
+        compact_len = len(compact)
+        if compact_len > 10:
+            meaningful = len(SPAM_MEANINGFUL_PATTERN.findall(compact))
+    return length, repeat, noise, url, compact_len, meaningful
+
 def spam_score_message(message, spam_list, dup_counter, id_counter, user_id=None):
     if not message:
         return 999
 
-    for s in spam_list:
-        if s and s in message:
-            return 999
+    if get_spam_matcher(spam_list).search(message):
+        return 999
 
+    length, repeat, noise, url, compact_len, meaningful = spam_features(message)
     score = 0
-    length = len(message)
     if length <= 2:
         score += 3
     elif length <= 5:
@@ -502,19 +894,15 @@ def spam_score_message(message, spam_list, dup_counter, id_counter, user_id=None
     if length >= 1000:
         score += 3
 
-    if SPAM_REPEAT_PATTERN.search(message):
+    if repeat:
         score += 3
-    if SPAM_NOISE_PATTERN.search(message):
+    if noise:
         score += 2
-    if SPAM_URL_PATTERN.search(message):
+    if url:
         score += 2
 
-    compact = WHITESPACE_PATTERN.sub("", message)
-    if compact:
-        meaningful = len(SPAM_MEANINGFUL_PATTERN.findall(compact))
-        ratio = meaningful / max(len(compact), 1)
-        if ratio < 0.3 and len(compact) > 10:
-            score += 2
+    if compact_len > 10 and meaningful / compact_len < 0.3:
+        score += 2
 
     norm = normalize_message(message)
     if norm:
@@ -536,16 +924,477 @@ def spam_score_message(message, spam_list, dup_counter, id_counter, user_id=None
 
     return score
 
-def parse_dat_content(text_data, spam_list=None):
-    if not text_data:
-        return ""
-    spam_terms = spam_list or ()
-    comments = []
-    dup_counter = {}
-    id_counter = {}
-    filtered = 0
-    for line in text_data.splitlines()[1:]:
-        parts = line.split("<>", 4)
+def _simhash_lane_table():
+    # Byte value -> its 8 bits spread into 16-bit lanes, so one big-int add
+    # per byte counts all bit positions at once.
+    table = []
+    for value in range(256):
+        spread = 0
+        for bit in range(8):
+            if value >> bit & 1:
+                spread |= 1 << (bit * 16)
+        table.append(spread)
+    return table
+
+_SIMHASH_LANES = _simhash_lane_table()
+
+def simhash(text, shingle=3):
+    """64-bit SimHash over character shingles (no word boundaries needed for Japanese)."""
+    if len(text) <= shingle:
+        grams = [text]
+    else:
+        grams = [text[i:i + shingle] for i in range(len(text) - shingle + 1)]
+    lanes = _SIMHASH_LANES
+    b0 = b1 = b2 = b3 = b4 = b5 = b6 = b7 = 0
+    for gram in grams:
+        # hash() is salted per process; fingerprints are only compared within a run.
+        h = hash(gram)
+        b0 += lanes[h & 0xFF]
+        b1 += lanes[h >> 8 & 0xFF]
+        b2 += lanes[h >> 16 & 0xFF]
+        b3 += lanes[h >> 24 & 0xFF]
+        b4 += lanes[h >> 32 & 0xFF]
+        b5 += lanes[h >> 40 & 0xFF]
+        b6 += lanes[h >> 48 & 0xFF]
+        b7 += lanes[h >> 56 & 0xFF]
+    half = len(grams) / 2
+    fingerprint = 0
+    bit = 0
+    for counts in (b0, b1, b2, b3, b4, b5, b6, b7):
+        for lane in range(8):
+            if (counts >> (lane * 16) & 0xFFFF) > half:
+                fingerprint |= 1 << bit
+            bit += 1
+    return fingerprint
+
+class NearDuplicateIndex:
+    """
+    SimHash index of posts already kept in this run, shared by all threads.
+    Fingerprints are split into max_distance + 1 bands; any fingerprint
+    within max_distance bits shares at least one band exactly, so lookups
+    only compare against posts in the same band buckets.
+    """
+
+    def __init__(self, max_distance=NEAR_DUP_MAX_DISTANCE, min_chars=NEAR_DUP_MIN_CHARS):
+        self.max_distance = max_distance
+        self.min_chars = min_chars
+        self.bands = max_distance + 1
+        self.band_bits = 64 // self.bands if self.bands > 0 else 64
+        self.buckets = {}
+        self.dropped = 0
+        self.chars_saved = 0
+
+    def _band_keys(self, fingerprint):
+        mask = (1 << self.band_bits) - 1
+        return [(band, fingerprint >> (band * self.band_bits) & mask) for band in range(self.bands)]
+
+    def is_duplicate(self, message):
+        """Return True for a near-duplicate of an earlier post; otherwise index it."""
+        if self.max_distance < 0:
+            return False
+        norm = normalize_message(message)
+        if len(norm) < self.min_chars:
+            return False
+        fingerprint = simhash(norm)
+        keys = self._band_keys(fingerprint)
+        for key in keys:
+            for other in self.buckets.get(key, ()):
+                if bin(fingerprint ^ other).count("1") <= self.max_distance:
+                    return True
+        for key in keys:
+            self.buckets.setdefault(key, []).append(fingerprint)
+        return False
+
+    def filter_posts(self, posts, indices=None):
+        """Return the indices of `posts` (a PostBatch) that are not near-duplicates."""
+        indices = posts.indices() if indices is None else indices
+        if self.max_distance < 0:
+            return list(indices)
+        kept = []
+        for i, text in zip(indices, posts.texts(indices)):
+            if self.is_duplicate(text):
+                self.dropped += 1
+                self.chars_saved += posts.length(i) + 1
+                continue
+            kept.append(i)
+        return kept
+
+class PostBatch:
+    """
+    Accepted posts of one thread as parallel columns (res number, post time
+    as epoch seconds or 0.0 when unknown, ID, spam score) plus start/end offsets into a single text buffer.
+    Nothing downstream needs a per-post string until the prompt is built:
+    selection works on indices and lengths, and render() joins once.
+    `first` is the oldest live post; tail mode advances it instead of
+    copying the remaining posts.
+    """
+    __slots__ = ("res", "timestamps", "post_ids", "scores", "starts", "ends", "first", "_buffer", "_pending", "_size")
+
+    def __init__(self):
+        self.res = array("l")
+        self.timestamps = array("d")
+        self.post_ids = []
+        self.scores = array("h")
+        self.starts = array("l")
+        self.ends = array("l")
+        self.first = 0
+        self._buffer = ""
+        self._pending = []
+        self._size = 0
+
+    def __len__(self):
+        return len(self.starts) - self.first
+
+    def append(self, text, res=0, timestamp=0.0, post_id=None, score=0):
+        self.res.append(res)
+        self.timestamps.append(timestamp)
+        self.post_ids.append(post_id)
+        self.scores.append(score)
+        self.starts.append(self._size)
+        self._size += len(text)
+        self.ends.append(self._size)
+        self._pending.append(text)
+
+    def indices(self):
+        return range(self.first, len(self.starts))
+
+    def length(self, i):
+        return self.ends[i] - self.starts[i]
+
+    def buffer(self):
+        if self._pending:
+            self._buffer += "".join(self._pending)
+            self._pending = []
+        return self._buffer
+
+    def text(self, i):
+        return self.buffer()[self.starts[i]:self.ends[i]]
+
+    def texts(self, indices=None):
+        buf = self.buffer()
+        starts, ends = self.starts, self.ends
+        for i in (self.indices() if indices is None else indices):
+            yield buf[starts[i]:ends[i]]
+
+    def drop_front(self, count=1):
+        self.first += count
+        # Compact once the dead prefix dominates, so long monitor runs stay bounded.
+        if self.first >= 256 and self.first * 2 >= len(self.starts):
+            self._compact()
+
+    def _compact(self):
+        first = self.first
+        offset = self.starts[first] if first < len(self.starts) else self._size
+        self._buffer = self.buffer()[offset:]
+        self._size -= offset
+        self.res = self.res[first:]
+        self.timestamps = self.timestamps[first:]
+        self.post_ids = self.post_ids[first:]
+        self.scores = self.scores[first:]
+        self.starts = array("l", (x - offset for x in self.starts[first:]))
+        self.ends = array("l", (x - offset for x in self.ends[first:]))
+        self.first = 0
+
+    def render(self, indices=None, max_chars=None, from_end=False):
+        """Join the selected posts with newlines; the only place post text is copied."""
+        full_text = "\n".join(self.texts(indices))
+        if max_chars is not None and len(full_text) > max_chars:
+            return full_text[-max_chars:] if from_end else full_text[:max_chars]
+        return full_text
+
+    def to_json(self):
+        indices = self.indices()
+        return {
+            "text": "".join(self.texts(indices)),
+            "lengths": [self.length(i) for i in indices],
+            "res": self.res[self.first:].tolist(),
+            "timestamps": self.timestamps[self.first:].tolist(),
+            "ids": self.post_ids[self.first:],
+            "scores": self.scores[self.first:].tolist()
+        }
+
+    @classmethod
+    def from_json(cls, data):
+        batch = cls()
+        text = data.get("text") or ""
+        pos = 0
+        for length, res, timestamp, post_id, score in zip(
+            data.get("lengths") or [], data.get("res") or [], data.get("timestamps") or [],
+            data.get("ids") or [], data.get("scores") or []
+        ):
+            batch.append(text[pos:pos + length], res, timestamp, post_id, score)
+            pos += length
+        return batch
+
+def new_parse_state(spam_terms=(), mode=TEXT_MODE_HEAD, budget=DAT_TEXT_BUDGET):
+    return {
+        "spam_key": tuple(spam_terms),
+        "mode": mode,
+        "budget": budget,
+        "lines": 0,
+        "posts": PostBatch(),
+        "chars": 0,
+        "full": False,
+        "dup_counter": {},
+        "id_counter": {},
+        "replies": {},
+        "filtered": 0
+    }
+
+def parse_state_matches(state, spam_terms, mode, budget=DAT_TEXT_BUDGET):
+    return (
+        state is not None and
+        state.get("spam_key") == tuple(spam_terms) and
+        state.get("mode") == mode and
+        state.get("budget") == budget
+    )
+
+def add_post(state, text, res=0, timestamp=0.0, post_id=None, score=0):
+    """Append one accepted post while keeping the state within its text budget."""
+    posts = state["posts"]
+    posts.append(text, res, timestamp, post_id, score)
+    state["chars"] += len(text) + (1 if len(posts) > 1 else 0)
+    budget = state["budget"]
+    if state["mode"] == TEXT_MODE_TAIL:
+        # Drop the oldest posts that can no longer reach the last `budget` chars.
+        while len(posts) > 1 and state["chars"] - posts.length(posts.first) - 1 >= budget:
+            state["chars"] -= posts.length(posts.first) + 1
+            posts.drop_front()
+    elif state["mode"] == TEXT_MODE_HEAD and state["chars"] >= budget:
+        state["full"] = True
+
+def anchor_targets(text, res):
+    """Earlier res numbers a post anchors to (">>N"), each once."""
+    targets = set()
+    for m in ANCHOR_PATTERN.finditer(text):
+        for part in ANCHOR_PART_PATTERN.finditer(m.group(1)):
+            start = int(part.group(1))
+            end = int(part.group(2)) if part.group(2) else start
+            if end < start or end - start >= ANCHOR_RANGE_MAX:
+                continue
+            targets.update(n for n in range(start, end + 1) if 0 < n < res)
+    return targets
+
+def record_replies(state, text, res):
+    """Add a post's anchors to the thread's reply graph (state["replies"]: res -> replies received)."""
+    if not res or (">" not in text and "\uFF1E" not in text and "\u226B" not in text):
+        return
+    replies = state["replies"]
+    for target in anchor_targets(text, res):
+        replies[target] = replies.get(target, 0) + 1
+
+def post_timestamp(meta):
+    """Epoch seconds of a DAT date field ("2024/01/01(月) 12:34:56.78 ID:..." in JST), 0.0 if absent."""
+    m = DAT_DATE_PATTERN.search(meta or "")
+    if not m:
+        return 0.0
+    year, month, day, hour, minute, second, fraction = m.groups()
+    try:
+        posted = datetime.datetime(int(year), int(month), int(day), int(hour), int(minute), int(second), tzinfo=JST)
+    except ValueError:
+        return 0.0
+    return posted.timestamp() + (float(f"0.{fraction}") if fraction else 0.0)
+
+def window_indices(posts, since=None, until=None):
+    """
+    Indices of posts written at or after `since` and before `until` (epoch
+    seconds). Posts without a parsable time (e.g. from the HTML fallback)
+    are kept, since there is no way to tell whether they are new.
+    """
+    if since is None and until is None:
+        return posts.indices()
+    since = float("-inf") if since is None else since
+    until = float("inf") if until is None else until
+    timestamps = posts.timestamps
+    return [i for i in posts.indices() if not timestamps[i] or since <= timestamps[i] < until]
+
+def post_signals(state, indices, scanner):
+    """
+    Signal of each post: replies received times SIGNAL_REPLY_WEIGHT, plus
+    SIGNAL_TICKER_WEIGHT if it names a ticker. Returns ({index: signal},
+    number of posts naming a ticker).
+    """
+    posts = state["posts"]
+    replies = state["replies"]
+    res = posts.res
+    signals = {}
+    ticker_posts = 0
+    for i, text in zip(indices, posts.texts(indices)):
+        value = replies.get(res[i], 0) * SIGNAL_REPLY_WEIGHT
+        if scanner.mentions(text):
+            value += SIGNAL_TICKER_WEIGHT
+            ticker_posts += 1
+        signals[i] = value
+    return signals, ticker_posts
+
+def select_by_signal(state, signals, budget):
+    """
+    Pick posts of a score-mode state within `budget` chars: highest signal
+    first, newest first on ties. Posts with no signal may only fill
+    SIGNAL_CHATTER_SHARE of the thread's own text budget. Returns the indices
+    in thread order.
+    """
+    posts = state["posts"]
+    chatter_budget = state["budget"] * SIGNAL_CHATTER_SHARE
+    used = chatter = 0
+    chosen = []
+    for i in sorted(signals, key=lambda i: (-signals[i], -i)):
+        cost = posts.length(i) + (1 if chosen else 0)
+        if used + cost > budget:
+            continue
+        if not signals[i]:
+            if chatter + cost > chatter_budget:
+                continue
+            chatter += cost
+        used += cost
+        chosen.append(i)
+    chosen.sort()
+    return chosen
+
+def fit_indices(posts, indices, budget, from_end=False):
+    """The longest run of whole posts from the start (or end) of `indices` that fits in `budget` chars."""
+    ordered = reversed(indices) if from_end else indices
+    used = 0
+    chosen = []
+    for i in ordered:
+        cost = posts.length(i) + (1 if chosen else 0)
+        if used + cost > budget:
+            break
+        used += cost
+        chosen.append(i)
+    if from_end:
+        chosen.reverse()
+    return chosen
+
+def plan_thread_text(name, state, indices, scanner, now=None):
+    """
+    Describe one thread's candidate posts for allocate_text_budget(): how many
+    chars it could use ("capacity") and how much it deserves ("weight" from
+    recency, post velocity and ticker density).
+    """
+    now = time.time() if now is None else now
+    posts = state["posts"]
+    indices = list(indices)
+    signals, ticker_posts = post_signals(state, indices, scanner)
+    if state["mode"] == TEXT_MODE_SCORE:
+        capacity = sum(posts.length(i) + 1 for i in indices if signals[i])
+        chatter = sum(posts.length(i) + 1 for i in indices if not signals[i])
+        capacity += min(chatter, int(state["budget"] * SIGNAL_CHATTER_SHARE))
+        capacity = max(capacity - 1, 0)
+    else:
+        # Head/tail states already hold at most their own budget of text.
+        capacity = min(sum(posts.length(i) for i in indices) + max(len(indices) - 1, 0), state["budget"])
+
+    timestamps = [posts.timestamps[i] for i in indices if posts.timestamps[i]]
+    if timestamps:
+        recency = 0.5 ** (max(now - max(timestamps), 0.0) / THREAD_RECENCY_HALF_LIFE)
+        velocity = sum(1 for ts in timestamps if ts >= now - THREAD_VELOCITY_WINDOW)
+    else:
+        # HTML fallback posts carry no times.
+        recency = 0.5
+        velocity = 0
+    return {
+        "name": name,
+        "state": state,
+        "indices": indices,
+        "signals": signals,
+        "header": f"\n--- Thread: {name} ---\n",
+        "capacity": capacity,
+        "recency": recency,
+        "velocity": velocity,
+        "density": ticker_posts / len(indices) if indices else 0.0
+    }
+
+def prompt_text_totals():
+    """Thread-text budget of the (primary, fallback) model variants."""
+    totals = (GEMINI_MAX_INPUT_CHARS, GEMINI_FALLBACK_INPUT_CHARS)
+    if PROMPT_TEXT_BUDGET > 0:
+        return tuple(min(PROMPT_TEXT_BUDGET, total) for total in totals)
+    return totals
+
+def allocate_text_budget(plans, totals):
+    """
+    Split each total (one per model variant) across the planned threads in
+    one pass: weights are THREAD_WEIGHT_BASE + recency + relative velocity +
+    ticker density, and budget a thread cannot use is handed to the others.
+    Returns one list of per-thread char budgets per total.
+    """
+    top_velocity = max((plan["velocity"] for plan in plans), default=0) or 1
+    weights = [
+        THREAD_WEIGHT_BASE + plan["recency"] + plan["velocity"] / top_velocity + plan["density"]
+        for plan in plans
+    ]
+    allocations = []
+    for total in totals:
+        remaining = total - sum(len(plan["header"]) for plan in plans)
+        alloc = [0] * len(plans)
+        active = [i for i, plan in enumerate(plans) if plan["capacity"] > 0]
+        while active and remaining > 0:
+            weight_sum = sum(weights[i] for i in active)
+            shares = {i: remaining * weights[i] / weight_sum for i in active}
+            saturated = [i for i in active if alloc[i] + shares[i] >= plans[i]["capacity"]]
+            if not saturated:
+                for i in active:
+                    alloc[i] += int(shares[i])
+                break
+            for i in saturated:
+                remaining -= plans[i]["capacity"] - alloc[i]
+                alloc[i] = plans[i]["capacity"]
+            active = [i for i in active if i not in saturated]
+        allocations.append(alloc)
+    return allocations
+
+def thread_plan_indices(plan, budget):
+    state = plan["state"]
+    if budget <= 0:
+        return []
+    if state["mode"] == TEXT_MODE_SCORE:
+        return select_by_signal(state, plan["signals"], budget)
+    return fit_indices(state["posts"], plan["indices"], budget, from_end=state["mode"] == TEXT_MODE_TAIL)
+
+def resolve_window(spec, prev_state=None, now=None):
+    """
+    Turn a window spec into (label, since). Specs: "24h" (everything the
+    thread budgets hold, the historical default), "since-last" (posts newer
+    than the previous run) and "<N>m" / "<N>h" (last N minutes/hours).
+    The label is sent as the payload's "window".
+    """
+    now = time.time() if now is None else now
+    spec = (spec or DEFAULT_WINDOW).strip().lower()
+    if spec in ("", "all", DEFAULT_WINDOW):
+        return DEFAULT_WINDOW, None
+    if spec == WINDOW_SINCE_LAST:
+        last_end = _LAST_WINDOW_END
+        if last_end is None and prev_state:
+            last_end = prev_state.get("posts_until") or prev_state.get("timestamp")
+        if not last_end:
+            logging.info("No previous run recorded; analyzing the full window.")
+            return DEFAULT_WINDOW, None
+        return WINDOW_SINCE_LAST, float(last_end)
+    m = WINDOW_SPEC_PATTERN.match(spec)
+    if not m:
+        logging.warning(f"Unknown window '{spec}', using {DEFAULT_WINDOW}")
+        return DEFAULT_WINDOW, None
+    amount = int(m.group(1))
+    seconds = amount * (3600 if m.group(2) == "h" else 60)
+    return f"{amount}{m.group(2)}", now - seconds
+
+def iter_dat_posts(lines, spam_terms, state):
+    """
+    Yield (res, timestamp, post_id, score, message) for each cleaned,
+    non-spam post in the DAT lines, one line at a time.
+    `lines` can be any line iterable: a list, an open cache file, or
+    resp.iter_lines() (bytes lines are decoded as CP932). The spam counters
+    live in `state`, so feeding a thread in chunks yields exactly what a
+    single pass over the whole DAT would.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("CP932", errors="replace")
+        state["lines"] += 1
+        if state["lines"] == 1:
+            continue
+        parts = line.rstrip("\n").split("<>", 4)
         if len(parts) >= 4:
             meta = parts[2]
             msg = parts[3]
@@ -555,21 +1404,508 @@ def parse_dat_content(text_data, spam_list=None):
                 continue
 
             user_id = extract_post_id(meta)
-            score = spam_score_message(clean_msg, spam_terms, dup_counter, id_counter, user_id)
+            score = spam_score_message(clean_msg, spam_terms, state["dup_counter"], state["id_counter"], user_id)
             if score >= SPAM_SCORE_THRESHOLD:
-                filtered += 1
+                state["filtered"] += 1
                 continue
 
-            comments.append(clean_msg)
+            yield state["lines"], post_timestamp(meta), user_id, score, clean_msg
+
+def parse_dat_lines(lines, spam_terms, state):
+    # In head mode the text is frozen once the budget is met, so the rest of
+    # the input (and every later append) is never read.
+    if state["full"]:
+        return 0
+    filtered_before = state["filtered"]
+    for res, timestamp, user_id, score, msg in iter_dat_posts(lines, spam_terms, state):
+        record_replies(state, msg, res)
+        add_post(state, msg, res, timestamp, user_id, score)
+        if state["full"]:
+            break
+    return state["filtered"] - filtered_before
+
+def render_parsed_text(state, indices=None):
+    posts = state.get("posts") if state else None
+    if not posts: return ""
+    return posts.render(indices, state["budget"], from_end=state["mode"] == TEXT_MODE_TAIL)
 
+def split_dat_lines(text_data):
+    # DAT posts are newline-terminated; str.splitlines() would also break on
+    # \u2028 and friends that can appear inside a post. Works on raw bytes too.
+    if not text_data:
+        return []
+    lines = text_data.split(b"\n" if isinstance(text_data, bytes) else "\n")
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+def parse_dat_content(text_data, spam_list=None, mode=TEXT_MODE_HEAD):
+    if not text_data:
+        return ""
+    spam_terms = spam_list or ()
+    state = new_parse_state(spam_terms, mode)
+    filtered = parse_dat_lines(split_dat_lines(text_data), spam_terms, state)
     if filtered:
         logging.info(f"Soft-spam filtered: {filtered} posts")
-    if not comments: return ""
-    full_text = "\n".join(comments)
-    if len(full_text) > 15000: return full_text[:15000]
-    return full_text
+    return render_parsed_text(state)
+
+def parse_dat_chunk(lines, spam_terms, state):
+    """Parse DAT lines into `state`; returns (state, filtered). Runs in-process or in a parse worker."""
+    spam_terms = get_spam_matcher(spam_terms)
+    filtered = parse_dat_lines(lines, spam_terms, state)
+    return state, filtered
+
+def get_parse_pool():
+    global _PARSE_POOL
+    if PARSE_PROCESSES <= 0:
+        return None
+    with _PARSE_POOL_LOCK:
+        if _PARSE_POOL is None:
+            # spawn, not fork: the fetch threads may hold locks at fork time.
+            _PARSE_POOL = ProcessPoolExecutor(
+                max_workers=PARSE_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _PARSE_POOL
+
+def offload_parse(fn, size, *args):
+    """
+    Run a parse function in the process pool when the input is at least
+    PARSE_PROCESS_MIN_CHARS, otherwise (or if the pool fails) in-process.
+    The worker gets pickled copies, so callers must use the returned state.
+    """
+    global _PARSE_POOL
+    pool = get_parse_pool() if size >= PARSE_PROCESS_MIN_CHARS else None
+    if pool is not None:
+        # The automaton stays in this process; workers rebuild it from the terms.
+        worker_args = tuple(tuple(arg) if isinstance(arg, SpamMatcher) else arg for arg in args)
+        try:
+            result = pool.submit(fn, *worker_args).result()
+            with _PARSE_POOL_LOCK:
+                _PARSE_STATS["pool"] += 1
+            return result
+        except Exception as e:
+            logging.warning(f"Parse worker failed, parsing in-process: {e}")
+            with _PARSE_POOL_LOCK:
+                if _PARSE_POOL is pool:
+                    _PARSE_POOL = None
+            pool.shutdown(wait=False, cancel_futures=True)
+    with _PARSE_POOL_LOCK:
+        _PARSE_STATS["inline"] += 1
+    return fn(*args)
+
+def dat_cache_path(thread_id, compressed=False):
+    return os.path.join(CACHE_DIR, f"{thread_id}.dat.gz" if compressed else f"{thread_id}.dat")
+
+def count_dat_lines(path):
+    """Count newline-terminated lines of a plain cached DAT through a memory map."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            count = 0
+            pos = mm.find(b"\n")
+            while pos != -1:
+                count += 1
+                pos = mm.find(b"\n", pos + 1)
+            return count
+
+def adopt_legacy_cache(legacy_index):
+    # One-off migration from older stores (plain .dat directory, or the v2
+    # manifest), which kept DATs re-encoded as UTF-8: convert them back to
+    # CP932 bytes. Also rebuilds a lost manifest of the current store, whose
+    # files are already CP932. The only full listing the store ever does;
+    # afterwards everything is driven by the manifest, so files that cannot
+    # be adopted are deleted rather than left outside eviction.
+    threads = {}
+    if not os.path.isdir(CACHE_DIR):
+        return threads
+    if isinstance(legacy_index.get("threads"), dict):
+        legacy_index = legacy_index["threads"]
+    for name in os.listdir(CACHE_DIR):
+        if name.endswith(".dat"):
+            thread_id = name[:-4]
+        elif name.endswith(".dat.gz"):
+            thread_id = name[:-7]
+        else:
+            continue
+        path = os.path.join(CACHE_DIR, name)
+        plain_path = dat_cache_path(thread_id)
+        try:
+            opener = gzip.open if name.endswith(".gz") else open
+            with opener(path, "rb") as f:
+                data = f.read()
+            try:
+                # Strict UTF-8 tells the stores apart: CP932 Japanese is almost never
+                # valid UTF-8, while UTF-8 text often decodes as CP932.
+                data = data.decode("utf-8").encode("CP932", errors="replace")
+            except UnicodeDecodeError:
+                pass
+            tmp_path = plain_path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, plain_path)
+            if path != plain_path:
+                os.remove(path)
+            line_count = count_dat_lines(plain_path)
+            stat = os.stat(plain_path)
+        except Exception as e:
+            logging.warning(f"Failed to adopt cache {name}, removing it: {e}")
+            for stale_path in (path, plain_path + ".tmp", parsed_cache_path(thread_id)):
+                if os.path.exists(stale_path):
+                    try:
+                        os.remove(stale_path)
+                    except Exception as e:
+                        logging.warning(f"Failed to remove cache {stale_path}: {e}")
+            continue
+        entry = dict(legacy_index.get(thread_id) or {})
+        entry.setdefault("offset", 0)
+        entry["last_res"] = max(int(entry.get("last_res") or 0), line_count)
+        entry["finished"] = bool(entry.get("finished")) or line_count >= DAT_FINISHED_LINES
+        entry.update({
+            "size": stat.st_size,
+            "raw_size": stat.st_size,
+            "compressed": False,
+            "mtime": stat.st_mtime,
+            "last_access": entry.get("last_access") or stat.st_mtime
+        })
+        threads[thread_id] = entry
+        if entry["finished"]:
+            compress_cached_dat(thread_id, entry)
+    if threads:
+        logging.info(f"Adopted {len(threads)} cached DATs into the cache manifest.")
+    return threads
+
+def load_dat_index():
+    global _DAT_INDEX
+    with _CACHE_LOCK:
+        if _DAT_INDEX is None:
+            data = {}
+            if os.path.exists(DAT_INDEX_FILE):
+                try:
+                    with open(DAT_INDEX_FILE, "r", encoding="utf-8") as f:
+                        data = json.load(f)
+                except Exception as e:
+                    logging.warning(f"Failed to load dat index: {e}")
+            if isinstance(data, dict) and data.get("version") == DAT_STORE_VERSION and isinstance(data.get("threads"), dict):
+                _DAT_INDEX = data["threads"]
+            else:
+                _DAT_INDEX = adopt_legacy_cache(data if isinstance(data, dict) else {})
+                save_dat_index()
+    return _DAT_INDEX
 
-def fetch_thread_text(url, spam_list=None):
+def save_dat_index():
+    if _DAT_INDEX is None:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with _CACHE_LOCK:
+            tmp_path = DAT_INDEX_FILE + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"version": DAT_STORE_VERSION, "threads": _DAT_INDEX}, f, ensure_ascii=False)
+            os.replace(tmp_path, DAT_INDEX_FILE)
+    except Exception as e:
+        logging.warning(f"Failed to save dat index: {e}")
+
+@contextmanager
+def cached_dat_lines(thread_id):
+    """
+    Yield an iterator over the cached DAT's raw CP932 lines, or None if it is
+    unavailable. Active threads are read through a memory map, finished ones
+    through gzip; lines are decoded only when the parser consumes them.
+    """
+    entry = load_dat_index().get(thread_id)
+    if not entry:
+        yield None
+        return
+    compressed = bool(entry.get("compressed"))
+    path = dat_cache_path(thread_id, compressed)
+    try:
+        f = gzip.open(path, "rb") if compressed else open(path, "rb")
+    except Exception as e:
+        logging.warning(f"Cache read error: {e}")
+        yield None
+        return
+    entry["last_access"] = time.time()
+    with f:
+        if compressed:
+            yield f
+        elif os.fstat(f.fileno()).st_size == 0:
+            yield iter(())
+        else:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                yield iter(mm.readline, b"")
+
+def write_cached_dat(thread_id, data, reset):
+    # Raw bytes exactly as the server sent them (CP932).
+    with open(dat_cache_path(thread_id), "wb" if reset else "ab") as f:
+        f.write(data)
+    return len(data)
+
+def compress_cached_dat(thread_id, entry):
+    # Finished threads never change again, so they are stored gzip-compressed.
+    plain_path = dat_cache_path(thread_id)
+    gz_path = dat_cache_path(thread_id, compressed=True)
+    try:
+        tmp_path = gz_path + ".tmp"
+        with open(plain_path, "rb") as src, gzip.open(tmp_path, "wb", compresslevel=6) as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(tmp_path, gz_path)
+        os.remove(plain_path)
+        entry["compressed"] = True
+        entry["size"] = os.path.getsize(gz_path)
+    except Exception as e:
+        logging.warning(f"Failed to compress cache {thread_id}: {e}")
+
+def drop_cached_thread(thread_id):
+    index = load_dat_index()
+    with _CACHE_LOCK:
+        index.pop(thread_id, None)
+        _THREAD_PARSE_STATES.pop(thread_id, None)
+        meta = load_http_meta()
+        for url in [u for u in meta if u.endswith(f"/{thread_id}.dat")]:
+            meta.pop(url, None)
+    for path in (dat_cache_path(thread_id), dat_cache_path(thread_id, compressed=True), parsed_cache_path(thread_id)):
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except Exception as e:
+                logging.warning(f"Failed to remove cache {path}: {e}")
+
+def cached_thread_bytes(entry):
+    """Disk used by one thread: its DAT (plain or gzip) plus its .posts.json."""
+    return int(entry.get("size") or 0) + int(entry.get("parsed_size") or 0)
+
+def prune_thread_parse_states(urls):
+    """Forget in-memory parse states of threads not in `urls`; they reload from .posts.json if needed."""
+    keep = {m.group(3) for m in map(THREAD_URL_PATTERN.match, urls) if m}
+    with _CACHE_LOCK:
+        for thread_id in [tid for tid in _THREAD_PARSE_STATES if tid not in keep]:
+            del _THREAD_PARSE_STATES[thread_id]
+
+def evict_dat_cache():
+    """Drop least recently used threads until the store fits DAT_CACHE_BUDGET_BYTES."""
+    index = load_dat_index()
+    evicted = []
+    with _CACHE_LOCK:
+        total = sum(cached_thread_bytes(e) for e in index.values())
+        if total > DAT_CACHE_BUDGET_BYTES:
+            for thread_id, entry in sorted(index.items(), key=lambda x: x[1].get("last_access") or 0):
+                if total <= DAT_CACHE_BUDGET_BYTES:
+                    break
+                total -= cached_thread_bytes(entry)
+                evicted.append(thread_id)
+        for thread_id in evicted:
+            drop_cached_thread(thread_id)
+            logging.info(f"Cleaned up old cache: {thread_id}")
+        # Also persists last_access updates made since the previous save.
+        save_dat_index()
+        if evicted:
+            save_http_meta()
+    return evicted
+
+def parsed_cache_path(thread_id):
+    return os.path.join(CACHE_DIR, f"{thread_id}.posts.json")
+
+def save_parsed_posts(thread_id, state):
+    entry = load_dat_index().get(thread_id)
+    if not entry:
+        return
+    try:
+        data = {
+            "version": PARSED_CACHE_VERSION,
+            "dat_size": int(entry.get("raw_size") or 0),
+            "spam_key": list(state["spam_key"]),
+            "mode": state["mode"],
+            "budget": state["budget"],
+            "lines": state["lines"],
+            "chars": state["chars"],
+            "full": state["full"],
+            "filtered": state["filtered"],
+            "dup_counter": state["dup_counter"],
+            "id_counter": state["id_counter"],
+            "replies": state["replies"],
+            "posts": state["posts"].to_json()
+        }
+        tmp_path = parsed_cache_path(thread_id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, parsed_cache_path(thread_id))
+        with _CACHE_LOCK:
+            entry["parsed_size"] = os.path.getsize(parsed_cache_path(thread_id))
+    except Exception as e:
+        logging.warning(f"Failed to save parsed cache {thread_id}: {e}")
+
+def load_parsed_posts(thread_id, spam_terms, mode=TEXT_MODE_HEAD):
+    # Valid only while the cached DAT has exactly the size it had when parsed.
+    entry = load_dat_index().get(thread_id)
+    path = parsed_cache_path(thread_id)
+    if not entry or not os.path.exists(path):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except Exception as e:
+        logging.warning(f"Parsed cache read error {thread_id}: {e}")
+        return None
+    if not isinstance(data, dict) or data.get("version") != PARSED_CACHE_VERSION:
+        return None
+    if data.get("dat_size") != int(entry.get("raw_size") or 0):
+        return None
+    if tuple(data.get("spam_key") or ()) != tuple(spam_terms):
+        return None
+    if data.get("mode") != mode or data.get("budget") != DAT_TEXT_BUDGET:
+        return None
+    state = new_parse_state(spam_terms, mode)
+    state["lines"] = int(data.get("lines") or 0)
+    state["chars"] = int(data.get("chars") or 0)
+    state["full"] = bool(data.get("full"))
+    state["filtered"] = int(data.get("filtered") or 0)
+    state["posts"] = PostBatch.from_json(data.get("posts") or {})
+    # Restoring the spam counters lets new lines be scored as if the whole DAT were re-parsed.
+    state["dup_counter"] = dict(data.get("dup_counter") or {})
+    state["id_counter"] = dict(data.get("id_counter") or {})
+    state["replies"] = {int(res): count for res, count in (data.get("replies") or {}).items()}
+    entry["last_access"] = time.time()
+    return state
+
+def parse_cached_dat(thread_id, spam_terms, mode=TEXT_MODE_HEAD):
+    state = new_parse_state(spam_terms, mode)
+    entry = load_dat_index().get(thread_id) or {}
+    try:
+        with cached_dat_lines(thread_id) as lines:
+            if lines is None:
+                return None
+            raw_size = int(entry.get("raw_size") or 0)
+            if PARSE_PROCESSES > 0 and raw_size >= PARSE_PROCESS_MIN_CHARS:
+                state, filtered = offload_parse(parse_dat_chunk, raw_size, list(lines), spam_terms, state)
+            else:
+                state, filtered = parse_dat_chunk(lines, spam_terms, state)
+    except Exception as e:
+        logging.warning(f"Cache read error: {e}")
+        return None
+    if filtered:
+        logging.info(f"Soft-spam filtered: {filtered} posts")
+    save_parsed_posts(thread_id, state)
+    return state
+
+def load_thread_state_from_cache(thread_id, spam_terms, mode=TEXT_MODE_HEAD):
+    state = load_parsed_posts(thread_id, spam_terms, mode)
+    if state is not None:
+        return state
+    return parse_cached_dat(thread_id, spam_terms, mode)
+
+def fetch_dat_incremental(dat_url, thread_id, full=False):
+    """
+    Fetch only the bytes appended to a DAT since the last run (HTTP Range) and
+    append them to the cache. Returns (new_lines, reset) or None on failure.
+    reset=True means the cache was rewritten and parsing must start over.
+    """
+    index = load_dat_index()
+    entry = index.get(thread_id) or {}
+    offset = int(entry.get("offset") or 0)
+    ranged = not full and offset > 0 and not entry.get("compressed") and os.path.exists(dat_cache_path(thread_id))
+
+    headers = dict(DAT_REQUEST_HEADERS)
+    if ranged:
+        # Start one byte early: the previous chunk must end in "\n", otherwise
+        # the DAT was rewritten (e.g. deleted posts) and the offset is stale.
+        headers["Range"] = f"bytes={offset - 1}-"
+        headers["Accept-Encoding"] = "identity"
+
+    resp = conditional_get(dat_url, headers=headers, timeout=10, label="dat", use_validators=ranged)
+    if ranged and resp.status_code == 304:
+        return [], False
+    if ranged and resp.status_code == 416:
+        # An unchanged DAT still answers 206 with the leading "\n"; 416 means the
+        # file is now shorter than the cached offset (rewritten or posts deleted).
+        logging.info(f"DAT shrank upstream, refetching: {thread_id}")
+        drop_cached_thread(thread_id)
+        return fetch_dat_incremental(dat_url, thread_id, full=True)
+    if ranged and resp.status_code == 206:
+        body = resp.content
+        if body[:1] != b"\n":
+            logging.info(f"DAT changed upstream, refetching: {thread_id}")
+            drop_cached_thread(thread_id)
+            return fetch_dat_incremental(dat_url, thread_id, full=True)
+        body = body[1:]
+        reset = False
+    elif resp.status_code == 200:
+        body = resp.content
+        reset = True
+        offset = 0
+    else:
+        return None
+
+    # Only consume complete lines; a partial trailing line is fetched next time.
+    consumed = body.rfind(b"\n") + 1
+    data = body[:consumed]
+    if reset and entry.get("compressed"):
+        drop_cached_thread(thread_id)
+    written = write_cached_dat(thread_id, data, reset)
+
+    # Raw CP932 lines (0x0A is never a CP932 trail byte, so splitting bytes is
+    # safe); the parser decodes each one only if it gets that far.
+    new_lines = split_dat_lines(data)
+    last_res = (0 if reset else int(entry.get("last_res") or 0)) + len(new_lines)
+    raw_size = (0 if reset else int(entry.get("raw_size") or 0)) + written
+    now = time.time()
+    entry = {} if reset else dict(entry)
+    entry.update({
+        "offset": offset + consumed,
+        "last_res": last_res,
+        "finished": last_res >= DAT_FINISHED_LINES,
+        "size": raw_size,
+        "raw_size": raw_size,
+        "compressed": False,
+        "mtime": now,
+        "last_access": now
+    })
+    if entry["finished"]:
+        compress_cached_dat(thread_id, entry)
+    with _CACHE_LOCK:
+        index[thread_id] = entry
+        save_dat_index()
+    return new_lines, reset
+
+def fetch_thread_html(url, spam_terms, mode=TEXT_MODE_HEAD):
+    logging.info("Fallback to HTML parsing...")
+    with host_slot(url):
+        resp = http_client.get(url, headers=DAT_REQUEST_HEADERS, timeout=10)
+    resp.encoding = "CP932"
+    page = resp.text
+    return offload_parse(parse_thread_html, len(page), page, spam_terms, mode)
+
+def parse_thread_html(page, spam_terms, mode=TEXT_MODE_HEAD):
+    spam_terms = get_spam_matcher(spam_terms)
+    msgs = html_extract.message_texts(page)
+
+    state = new_parse_state(spam_terms, mode, HTML_TEXT_BUDGET)
+    for res, text in enumerate(msgs[1:], start=2):
+        clean_text = clean_message(text)
+        if not clean_text:
+            continue
+
+        score = spam_score_message(clean_text, spam_terms, state["dup_counter"], state["id_counter"], None)
+        if score >= SPAM_SCORE_THRESHOLD:
+            state["filtered"] += 1
+            continue
+
+        record_replies(state, clean_text, res)
+        add_post(state, clean_text, res, score=score)
+        if state["full"]:
+            break
+
+    if state["filtered"]:
+        logging.info(f"Soft-spam filtered (html): {state['filtered']} posts")
+
+    return state
+
+def fetch_thread_text(url, spam_list=None, res_count=None, mode=TEXT_MODE_HEAD):
+    return render_parsed_text(fetch_thread_posts(url, spam_list, res_count, mode))
+
+def fetch_thread_posts(url, spam_list=None, res_count=None, mode=TEXT_MODE_HEAD):
+    """Return the thread's parse state (its PostBatch under "posts"), or None on failure."""
     spam_terms = spam_list or ()
     # Setup Cache
     os.makedirs(CACHE_DIR, exist_ok=True)
@@ -582,78 +1918,86 @@ def fetch_thread_text(url, spam_list=None):
         host, board, tid = m.groups()
         thread_id = tid
         dat_url = f"https://{host}/{board}/dat/{thread_id}.dat"
-    
-    if thread_id:
-        cache_path = os.path.join(CACHE_DIR, f"{thread_id}.dat")
-        if os.path.exists(cache_path):
-            try:
-                with open(cache_path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    if content.count('\n') >= 995: 
-                        logging.info(f"Using cached (finished): {thread_id}")
-                        return parse_dat_content(content, spam_terms)
-            except Exception as e:
-                logging.warning(f"Cache read error: {e}")
 
-    target_url = dat_url if dat_url else url
-    logging.info(f"Fetching {target_url}...")
-    
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-    }
-    
     try:
-        resp = requests.get(target_url, headers=headers, timeout=10)
-        
-        if dat_url and resp.status_code == 200:
-            resp.encoding = "CP932"
-            text_data = resp.text
-            if thread_id:
-                cache_path = os.path.join(CACHE_DIR, f"{thread_id}.dat")
-                with open(cache_path, "w", encoding="utf-8") as f:
-                    f.write(text_data)
-            return parse_dat_content(text_data, spam_terms)
-            
-        logging.info("Fallback to HTML parsing...")
-        resp.encoding = "CP932"
-        soup = BeautifulSoup(resp.text, "html.parser")
-        comments = []
-        msgs = soup.find_all("div", class_="message")
-        if not msgs: msgs = soup.find_all("dd", class_="thread_in")
-        if not msgs: msgs = soup.select("div.post > div.message")
-            
-        dup_counter = {}
-        id_counter = {}
-        filtered = 0
-        for msg in msgs[1:]:
-            text = msg.get_text(strip=True)
-
-            clean_text = clean_message(text)
-            if not clean_text:
-                continue
-
-            score = spam_score_message(clean_text, spam_terms, dup_counter, id_counter, None)
-            if score >= SPAM_SCORE_THRESHOLD:
-                filtered += 1
-                continue
-
-            comments.append(clean_text)
-
-        if filtered:
-            logging.info(f"Soft-spam filtered (html): {filtered} posts")
-
-        if not comments: return ""
-        full_text = "\n".join(comments)
-        if len(full_text) > 30000: return full_text[:30000]
-        return full_text
+        if not thread_id:
+            return fetch_thread_html(url, spam_terms, mode)
+
+        index = load_dat_index()
+        entry = index.get(thread_id)
+        state = _THREAD_PARSE_STATES.get(thread_id)
+        if not parse_state_matches(state, spam_terms, mode):
+            state = None
+
+        if entry and entry.get("finished"):
+            # Finished threads never change: parse the cache once per process.
+            if state is None:
+                state = load_thread_state_from_cache(thread_id, spam_terms, mode)
+            if state is not None:
+                _THREAD_PARSE_STATES[thread_id] = state
+                entry["last_access"] = time.time()
+                logging.info(f"Using cached (finished): {thread_id}")
+                return state
+        elif entry and state is None:
+            state = load_thread_state_from_cache(thread_id, spam_terms, mode)
+            if state is None:
+                with _CACHE_LOCK:
+                    index.pop(thread_id, None)
+                entry = None
+
+        if entry and state is not None and res_count is not None and entry.get("seen_res") == res_count:
+            # subject.txt reports the same res count as last time: nothing new to fetch.
+            _THREAD_PARSE_STATES[thread_id] = state
+            entry["last_access"] = time.time()
+            logging.info(f"Unchanged (res {res_count}), using cached: {thread_id}")
+            return state
+
+        if entry and state is not None and state["full"]:
+            # Head mode already holds a full budget of the oldest posts; appends cannot change it.
+            _THREAD_PARSE_STATES[thread_id] = state
+            entry["last_access"] = time.time()
+            logging.info(f"Text budget already filled, using cached: {thread_id}")
+            return state
+
+        logging.info(f"Fetching {dat_url}...")
+        scored_lines = int(entry.get("last_res") or 0) if entry else 0
+        result = fetch_dat_incremental(dat_url, thread_id)
+        if result is None:
+            return fetch_thread_html(url, spam_terms, mode)
+
+        new_lines, reset = result
+        if new_lines and not reset:
+            logging.info(f"Appended {len(new_lines)} new lines: {thread_id}")
+            if state is not None and not state["full"] and state["lines"] != scored_lines:
+                # The state does not end where the cache did; re-score everything once.
+                state = parse_cached_dat(thread_id, spam_terms, mode)
+                new_lines = []
+        if reset or state is None:
+            state = new_parse_state(spam_terms, mode)
+        if new_lines:
+            state, filtered = offload_parse(parse_dat_chunk, sum(map(len, new_lines)), new_lines, spam_terms, state)
+            if filtered:
+                logging.info(f"Soft-spam filtered: {filtered} posts")
+            save_parsed_posts(thread_id, state)
+        _THREAD_PARSE_STATES[thread_id] = state
+
+        entry = index.get(thread_id)
+        if entry and res_count is not None and int(entry.get("last_res") or 0) >= res_count:
+            if entry.get("seen_res") != res_count:
+                with _CACHE_LOCK:
+                    entry["seen_res"] = res_count
+                    save_dat_index()
+        return state
 
     except Exception as e:
         logging.error(f"Failed to fetch {url}: {e}")
-        return ""
+        return None
 
-def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, reddit_rankings=None, doughcon_data=None, sahm_data=None, earnings_hints=None):
+def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, reddit_rankings=None, doughcon_data=None, sahm_data=None, earnings_hints=None, fallback_text=None):
     """
     Combined analysis: Extracts tickers, Generates Summary, AND Comparative Insight.
+    fallback_text is the thread text sized for the fallback model; without it
+    the fallback model gets a prefix of `text`.
     """
     logging.info("Analyzing with Gemini (Combined Ticker Extraction & Summary & Breaking News)...")
     nicknames = nicknames or {}
@@ -688,10 +2032,9 @@ def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, red
     if earnings_hints:
         earnings_context = f"EARNINGS_HINTS (Top tickers from 5ch+Reddit, reference only): {json.dumps(earnings_hints, ensure_ascii=False)}"
 
-    max_chars_primary = int(os.getenv("GEMINI_MAX_INPUT_CHARS", "300000"))
-    max_chars_fallback = int(os.getenv("GEMINI_FALLBACK_INPUT_CHARS", "180000"))
+    texts = [text[:GEMINI_MAX_INPUT_CHARS], (fallback_text if fallback_text is not None else text)[:GEMINI_FALLBACK_INPUT_CHARS]]
 
-    def build_prompt(max_chars):
+    def build_prompt(prompt_text):
         return f"""
     You are a cynical 5ch Market AI.
     IMPORTANT POLICY: The PRIMARY GOAL is accurate Ticker Ranking. Extracting every single mentioned ticker is the #1 PRIORITY.
@@ -790,15 +2133,14 @@ def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, red
        - "summary" and "ongi_comment" must be plain strings, not nested objects.
        - Each ticker object must include "count" (>=1) and "sentiment" (-1.0 to 1.0).
     Text:
-    {text[:max_chars]}
+    {prompt_text}
     """
 
     # Use fast and cost-effective models
     models = ["gemini-3-flash-preview", "gemini-2.5-flash"]
     
     for i, model_name in enumerate(models):
-        max_chars = max_chars_primary if i == 0 else max_chars_fallback
-        prompt_text = build_prompt(max_chars)
+        prompt_text = build_prompt(texts[min(i, 1)])
         logging.info(f"Trying model: {model_name}...")
         url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={GEMINI_API_KEY}"
         headers = {"Content-Type": "application/json"}
@@ -808,7 +2150,7 @@ def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, red
         }
         
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=600)
+            resp = http_client.post(url, headers=headers, json=payload, timeout=600)
             if resp.status_code == 200:
                 logging.info(f"Gemini Success ({model_name})")
                 result = resp.json()
@@ -890,50 +2232,294 @@ def analyze_market_data(text, exclude_list, nicknames=None, prev_state=None, red
     logging.error("All Gemini models failed.")
     return [], "要約生成失敗", 50, {}, "", [], "", {}, {}, "Gemini (Fallback)"
 
-def get_janome_tokenizer():
-    global _JANOME_TOKENIZER
-    if _JANOME_TOKENIZER is None:
-        from janome.tokenizer import Tokenizer
-        _JANOME_TOKENIZER = Tokenizer()
-    return _JANOME_TOKENIZER
+class TopicFilter:
+    """
+    Compiled topic-word filter. The noun/sub-POS decision is cached per
+    analyzer POS value and the surface checks (digits, length, symbols, URLs)
+    per word, so each token costs two dict lookups once seen. Stopwords are a
+    frozenset, applied when counting so cached word lists stay config-free.
+    """
+
+    def __init__(self, stopwords=()):
+        self.stop_words = frozenset(stopwords or ())
+        self._pos_keep = {}
+        self._word_keep = {}
 
-def analyze_topics(text, stopwords_list=None):
-    logging.info("Analyzing topics (Keyword Extraction)...")
-    stop_words = set(stopwords_list or [])
-    
-    words = []
-    try:
-        tokenizer = get_janome_tokenizer()
-        tokens = tokenizer.tokenize(text)
-        for token in tokens:
-            pos_parts = token.part_of_speech.split(',')
-            main_pos = pos_parts[0]
-            sub_pos = pos_parts[1]
-            if main_pos == '名詞' and sub_pos not in ['非自立', '代名詞', '数', '接尾']:
-                word = token.surface
-                word = token.surface
-                if word.isdigit() or len(word) < 2 or word in stop_words: continue
-                # Filter symbols (Half-width and Full-width) including ～, ：, ”, ％
-                if re.search(r'[!-/:-@[-`{-~]', word): continue 
-                if re.search(r'[！-／：-＠［-｀｛-～、-〜”’・％]', word): continue
-                if 'http' in word or '.com' in word: continue
+    def _keep_word(self, word):
+        return not (
+            word.isdigit() or len(word) < 2 or
+            TOPIC_SYMBOL_PATTERN.search(word) or
+            'http' in word or '.com' in word
+        )
+
+    def words(self, backend, text):
+        """Nouns worth counting as topics, in text order (stopwords not applied)."""
+        pos_keep = self._pos_keep.setdefault(backend.name, {})
+        word_keep = self._word_keep
+        if len(word_keep) > TOPIC_WORD_CACHE_MAX:
+            word_keep.clear()
+        words = []
+        for word, pos in backend.tokens(text):
+            keep = pos_keep.get(pos)
+            if keep is None:
+                main_pos, sub_pos = backend.pos_tags(pos)
+                keep = pos_keep[pos] = main_pos == '名詞' and sub_pos not in TOPIC_SKIP_SUB_POS
+            if not keep:
+                continue
+            keep = word_keep.get(word)
+            if keep is None:
+                keep = word_keep[word] = self._keep_word(word)
+            if keep:
                 words.append(word)
-    except ImportError:
-        logging.warning("Janome not found. Falling back to Regex.")
-        pattern = re.compile(r"([一-龠ァ-ヶa-zA-Z]{2,})") 
-        matches = pattern.findall(text)
-        for w in matches:
-            if w not in stop_words and not w.isdigit() and len(w) > 1:
-                words.append(w)
-
-    counter = Counter(words)
-    
+        return words
+
+    def count(self, word_lists):
+        stop_words = self.stop_words
+        counter = Counter()
+        for words in word_lists:
+            counter.update(w for w in words if w not in stop_words)
+        return counter
+
+_TOPIC_FILTERS = {}
+
+def get_topic_filter(stopwords=()):
+    key = tuple(stopwords or ())
+    topic_filter = _TOPIC_FILTERS.get(key)
+    if topic_filter is None:
+        topic_filter = TopicFilter(key)
+        _TOPIC_FILTERS[key] = topic_filter
+    return topic_filter
+
+def topic_words(backend, text):
+    return get_topic_filter().words(backend, text)
+
+def tokenize_topic_shard(posts):
+    """Topic words of each post; runs in a topic worker, which keeps its tokenizer between calls."""
+    backend = topic_tokenizers.get_backend()
+    return [topic_words(backend, post) for post in posts]
+
+def get_topic_pool():
+    global _TOPIC_POOL
+    if TOPIC_PROCESSES <= 0:
+        return None
+    with _PARSE_POOL_LOCK:
+        if _TOPIC_POOL is None:
+            # Lives for the whole process, so monitor cycles reuse the loaded dictionaries.
+            _TOPIC_POOL = ProcessPoolExecutor(
+                max_workers=TOPIC_PROCESSES,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _TOPIC_POOL
+
+def tokenize_topic_posts(backend, posts):
+    """
+    Topic words of each post, in order. Large batches are split into
+    contiguous shards for the topic pool; if the pool fails they are
+    tokenized in-process.
+    """
+    global _TOPIC_POOL
+    pool = get_topic_pool() if len(posts) >= TOPIC_PROCESS_MIN_POSTS else None
+    if pool is not None:
+        shard_size = -(-len(posts) // (TOPIC_PROCESSES * 2))
+        shards = [posts[i:i + shard_size] for i in range(0, len(posts), shard_size)]
+        try:
+            return [words for shard in pool.map(tokenize_topic_shard, shards) for words in shard]
+        except Exception as e:
+            logging.warning(f"Topic workers failed, tokenizing in-process: {e}")
+            with _PARSE_POOL_LOCK:
+                if _TOPIC_POOL is pool:
+                    _TOPIC_POOL = None
+            pool.shutdown(wait=False, cancel_futures=True)
+    return [topic_words(backend, post) for post in posts]
+
+def topic_post_key(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=12).hexdigest()
+
+def topic_trend_post_id(url, res):
+    """Stable id of one post for the trend store: thread id (or URL) and res number."""
+    m = THREAD_URL_PATTERN.match(url)
+    return f"{m.group(3) if m else url}/{res}"
+
+def load_topic_token_cache(tokenizer_name):
+    """Filtered noun lists by post hash from earlier runs; empty if made by another tokenizer."""
+    global _TOPIC_TOKEN_CACHE
+    if _TOPIC_TOKEN_CACHE is None:
+        _TOPIC_TOKEN_CACHE = {}
+        if os.path.exists(TOPIC_TOKEN_CACHE_FILE):
+            try:
+                with open(TOPIC_TOKEN_CACHE_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get("version") == TOPIC_TOKEN_CACHE_VERSION:
+                    _TOPIC_TOKEN_CACHE = data
+            except Exception as e:
+                logging.warning(f"Failed to load topic token cache: {e}")
+    if _TOPIC_TOKEN_CACHE.get("tokenizer") != tokenizer_name:
+        return {}
+    return _TOPIC_TOKEN_CACHE.get("entries") or {}
+
+def save_topic_token_cache(tokenizer_name, entries):
+    # Only the posts of the latest run are kept; older ones have left the prompt.
+    global _TOPIC_TOKEN_CACHE
+    _TOPIC_TOKEN_CACHE = {"version": TOPIC_TOKEN_CACHE_VERSION, "tokenizer": tokenizer_name, "entries": entries}
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_path = TOPIC_TOKEN_CACHE_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(_TOPIC_TOKEN_CACHE, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, TOPIC_TOKEN_CACHE_FILE)
+    except Exception as e:
+        logging.warning(f"Failed to save topic token cache: {e}")
+
+def hour_start(timestamp):
+    return int(timestamp // 3600 * 3600)
+
+def load_topic_trends():
+    """Hourly topic counters: {"buckets": {hour: {word: count}}, "seen": {post id: hour}}."""
+    global _TOPIC_TRENDS
+    if _TOPIC_TRENDS is None:
+        _TOPIC_TRENDS = {"buckets": {}, "seen": {}}
+        if os.path.exists(TOPIC_TREND_FILE):
+            try:
+                with open(TOPIC_TREND_FILE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if isinstance(data, dict) and data.get("version") == TOPIC_TREND_VERSION:
+                    _TOPIC_TRENDS["buckets"] = {int(hour): counts for hour, counts in (data.get("buckets") or {}).items()}
+                    _TOPIC_TRENDS["seen"] = dict(data.get("seen") or {})
+            except Exception as e:
+                logging.warning(f"Failed to load topic trends: {e}")
+    return _TOPIC_TRENDS
+
+def save_topic_trends():
+    if _TOPIC_TRENDS is None:
+        return
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        data = {"version": TOPIC_TREND_VERSION, **_TOPIC_TRENDS}
+        tmp_path = TOPIC_TREND_FILE + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp_path, TOPIC_TREND_FILE)
+    except Exception as e:
+        logging.warning(f"Failed to save topic trends: {e}")
+
+def update_topic_trends(post_words, now=None):
+    """
+    Add posts not counted before to the hour bucket of their post time.
+    `post_words` is (post id, post time, words); a time of 0 means "now".
+    Buckets and seen ids older than the trend horizon are dropped, so
+    history is never recounted and the store stays bounded.
+    """
+    now = time.time() if now is None else now
+    trends = load_topic_trends()
+    buckets = trends["buckets"]
+    seen = trends["seen"]
+    horizon = hour_start(now) - (TREND_RECENT_HOURS + TREND_BASELINE_HOURS) * 3600
+    for hour in [hour for hour in buckets if hour < horizon]:
+        del buckets[hour]
+    for key in [key for key, hour in seen.items() if hour < horizon]:
+        del seen[key]
+
+    added = 0
+    for post_id, posted, words in post_words:
+        if post_id in seen:
+            continue
+        hour = hour_start(posted or now)
+        if hour < horizon:
+            continue
+        seen[post_id] = hour
+        bucket = buckets.setdefault(hour, {})
+        for word in words:
+            bucket[word] = bucket.get(word, 0) + 1
+        added += 1
+    if added:
+        save_topic_trends()
+    return added
+
+def topic_trends(stop_words=(), now=None):
+    """
+    {word: (recent count, trend)} for words seen in the recent hours, where
+    trend = (recent hourly rate + TREND_SMOOTHING) / (baseline hourly rate +
+    TREND_SMOOTHING). Empty until the store covers some baseline hours.
+    """
+    now = time.time() if now is None else now
+    buckets = load_topic_trends()["buckets"]
+    recent_start = hour_start(now) - (TREND_RECENT_HOURS - 1) * 3600
+    baseline_hours = [hour for hour in buckets if hour < recent_start]
+    if not baseline_hours:
+        return {}
+    recent = Counter()
+    baseline = Counter()
+    for hour, counts in buckets.items():
+        (recent if hour >= recent_start else baseline).update(counts)
+    recent_span = max((now - recent_start) / 3600, 1.0)
+    baseline_span = max((recent_start - min(baseline_hours)) / 3600, 1.0)
+    trends = {}
+    for word, count in recent.items():
+        if word in stop_words:
+            continue
+        ratio = (count / recent_span + TREND_SMOOTHING) / (baseline.get(word, 0) / baseline_span + TREND_SMOOTHING)
+        trends[word] = (count, ratio)
+    return trends
+
+def analyze_topics(text, stopwords_list=None, trend_posts=None):
+    """
+    Top 50 nouns of `text`, a string or a list of posts. Each post's noun
+    list is cached by its hash, so only posts not seen in the previous run
+    are tokenized. With `trend_posts` ((post id, post time, text) for every
+    post in the window, not just the prompt's) the hourly trend store is
+    updated, and each topic gets its "trend" ratio and a "surging" flag.
+    """
+    logging.info("Analyzing topics (Keyword Extraction)...")
+    posts = [text] if isinstance(text, str) else text
+
+    backend = topic_tokenizers.get_backend()
+    tokenizer_name = backend.name
+
+    cached = load_topic_token_cache(tokenizer_name)
+    entries = {}
+    missing = {}
+
+    def lookup(post):
+        key = topic_post_key(post)
+        if key not in entries and key not in missing:
+            words = cached.get(key)
+            if words is None:
+                missing[key] = post
+            else:
+                entries[key] = words
+        return key
+
+    keys = [lookup(post) for post in posts if post]
+    trend_keys = [(post_id, posted, lookup(post)) for post_id, posted, post in trend_posts or () if post]
+    if missing:
+        entries.update(zip(missing, tokenize_topic_posts(backend, list(missing.values()))))
+
+    # Merged in post order, so ties in most_common() rank exactly as a single pass would.
+    counter = get_topic_filter(stopwords_list).count(entries[key] for key in keys)
+    save_topic_token_cache(tokenizer_name, entries)
+    logging.info(f"Topic tokens: tokenized {len(missing)} of {len(entries)} posts, reused the rest")
+
     # Format top 50
     top_words = [{"word": k, "count": v} for k, v in counter.most_common(50)]
     
     logging.info("--- Top Topics ---")
     for t in top_words[:5]:
         logging.info(f"{t['word']}: {t['count']}")
+
+    if trend_posts is not None:
+        update_topic_trends((post_id, posted, entries[key]) for post_id, posted, key in trend_keys)
+        trends = topic_trends(get_topic_filter(stopwords_list).stop_words)
+        for t in top_words:
+            if t["word"] in trends:
+                recent_count, ratio = trends[t["word"]]
+                t["trend"] = round(ratio, 2)
+                t["surging"] = recent_count >= TREND_MIN_COUNT and ratio >= TREND_SURGE_RATIO
+        surging = sorted(
+            ((word, ratio) for word, (count, ratio) in trends.items() if count >= TREND_MIN_COUNT and ratio >= TREND_SURGE_RATIO),
+            key=lambda item: item[1], reverse=True
+        )
+        if surging:
+            logging.info("Surging topics: " + ", ".join(f"{word} x{ratio:.1f}" for word, ratio in surging[:10]))
         
     return top_words
 
@@ -943,7 +2529,7 @@ def fetch_apewisdom_rankings():
     """Fetch Top 20 stocks from ApeWisdom (WallStreetBets)"""
     url = "https://apewisdom.io/api/v1.0/filter/wallstreetbets/page/1"
     try:
-        resp = requests.get(url, timeout=10)
+        resp = http_client.get(url, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             items = []
@@ -978,29 +2564,19 @@ def post_json_with_retry(url, headers, payload, retries=3, timeout=30):
     if not content_type or "charset" not in content_type.lower():
         send_headers["Content-Type"] = "application/json; charset=utf-8"
 
-    last_resp = None
-    for attempt in range(retries):
-        try:
-            resp = requests.post(url, data=body_bytes, headers=send_headers, timeout=timeout)
-            last_resp = resp
-            if resp.status_code < 500 and resp.status_code != 429:
-                return resp
-            logging.warning(f"Worker upload attempt {attempt + 1} failed: {resp.status_code}")
-        except Exception as e:
-            logging.warning(f"Worker upload attempt {attempt + 1} error: {e}")
-
-        if attempt < retries - 1:
-            sleep_s = 5 * (2 ** attempt)
-            time.sleep(sleep_s)
-
-    return last_resp
+    policy = http_client.UPLOAD_RETRY.replace(attempts=retries)
+    try:
+        return http_client.post(url, retry=policy, data=body_bytes, headers=send_headers, timeout=timeout)
+    except Exception as e:
+        logging.warning(f"Worker upload error: {e}")
+        return None
 
 def fetch_doughcon_data():
     """Fetch Doughcon data from the API."""
     logging.info("Fetching Doughcon data...")
     url = "https://doughcon.com/api/v1/data" # Placeholder URL
     try:
-        resp = requests.get(url, timeout=10)
+        resp = http_client.get(url, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             logging.info("Successfully fetched Doughcon data.")
@@ -1012,7 +2588,7 @@ def fetch_doughcon_data():
     return None
 
 def send_to_worker(
-        tickers, topics, source_meta, summary, ongi_comment, fear_greed, radar, breaking_news, polymarket, cnn_fg, reddit_rankings, comparative_insight, brief_swing, brief_long, ai_model, doughcon_data, sahm_data, yield_curve_data, crypto_fg, hy_oas_data, market_breadth_data, volatility_data, hindenburg_omen_data
+        tickers, topics, source_meta, summary, ongi_comment, fear_greed, radar, breaking_news, polymarket, cnn_fg, reddit_rankings, comparative_insight, brief_swing, brief_long, ai_model, doughcon_data, sahm_data, yield_curve_data, crypto_fg, hy_oas_data, market_breadth_data, volatility_data, hindenburg_omen_data, window=DEFAULT_WINDOW
     ):
     logging.info(f"Sending {len(tickers)} tickers, {len(topics)} topics, {len(polymarket or [])} polymarket, {len(reddit_rankings or [])} reddit items to Worker...")
     if not WORKER_URL or not INGEST_TOKEN:
@@ -1033,7 +2609,7 @@ def send_to_worker(
     
     payload = {
         "updatedAt": datetime.datetime.now().isoformat(),
-        "window": "24h",
+        "window": window,
         "items": tickers,
         "topics": topics,
         "sources": source_meta,
@@ -1091,7 +2667,7 @@ def fetch_polymarket_events():
     
     def get_events(params):
         try:
-            r = requests.get(url, params=params, headers=headers, timeout=10)
+            r = http_client.get(url, params=params, headers=headers, timeout=10)
             if r.status_code == 200:
                 return r.json()
             return []
@@ -1261,7 +2837,7 @@ def translate_polymarket_events(events):
             payload["generationConfig"] = generation_config
             
         try:
-            resp = requests.post(url, headers=headers, json=payload, timeout=60)
+            resp = http_client.post(url, headers=headers, json=payload, timeout=60)
             if resp.status_code == 200:
                 res_json = resp.json()
                 try:
@@ -1379,7 +2955,7 @@ def fetch_cnn_fear_greed():
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
             "Referer": "https://edition.cnn.com/"
         }
-        resp = requests.get(url, headers=headers, timeout=10)
+        resp = http_client.get(url, headers=headers, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             fg = data.get("fear_and_greed", {})
@@ -1403,20 +2979,13 @@ def fetch_with_retry(url, retries=3, delay=2):
         "Accept-Language": "en-US,en;q=0.9",
         "Referer": "https://www.google.com/"
     }
-    
-    for i in range(retries):
-        try:
-            resp = requests.get(url, headers=headers, timeout=30)
-            if resp.status_code == 200:
-                return resp
-            logging.warning(f"Fetch failed {url}: Status {resp.status_code}")
-        except Exception as e:
-            logging.warning(f"Fetch error {url}: {e}")
-        
-        if i < retries - 1:
-            time.sleep(delay)
-            
-    return None
+    policy = http_client.PAGE_RETRY.replace(attempts=retries, delay=delay)
+    try:
+        resp = http_client.get(url, retry=policy, headers=headers, timeout=30)
+    except Exception as e:
+        logging.warning(f"Fetch error {url}: {e}")
+        return None
+    return resp if resp is not None and resp.status_code == 200 else None
 
 def fetch_fred_series_value(series_id):
     if not FRED_API_KEY:
@@ -1432,7 +3001,7 @@ def fetch_fred_series_value(series_id):
             "sort_order": "desc",
             "limit": 5
         }
-        resp = requests.get(url, params=params, timeout=10)
+        resp = http_client.get(url, params=params, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             for obs in data.get("observations", []):
@@ -1502,7 +3071,7 @@ def fetch_crypto_fear_greed():
     """Fetch Crypto Fear & Greed Index from Alternative.me"""
     try:
         url = "https://api.alternative.me/fng/?limit=1"
-        resp = requests.get(url, timeout=10)
+        resp = http_client.get(url, timeout=10)
         if resp.status_code == 200:
             data = resp.json()
             if data['data']:
@@ -1560,10 +3129,9 @@ def fetch_market_breadth():
         url = "https://indexmood.com/breadth/advance-decline/today"
         resp = fetch_with_retry(url)
         if not resp or resp.status_code != 200:
-            resp = requests.get(url, timeout=10)
+            resp = http_client.get(url, timeout=10)
         if resp:
-            soup = BeautifulSoup(resp.text, "html.parser")
-            plain = " ".join(soup.stripped_strings)
+            plain = html_extract.page_text(resp.text)
             m = re.search(r"A\\s*/?\\s*D\\s*Line:\\s*([-0-9,]+).*?Trend:\\s*([A-Za-z]+)", plain, re.IGNORECASE)
             if not m:
                 m = re.search(r"Net\\s+Advance\\s*/?\\s*Decline\\s*([-0-9,]+)", plain, re.IGNORECASE)
@@ -1760,7 +3328,7 @@ def fetch_wsj_markets_diary(markets_diary_type="diaries"):
         "Referer": "https://www.wsj.com/market-data/stocks/marketsdiary"
     }
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=15)
+        resp = http_client.get(url, params=params, headers=headers, timeout=15)
         if resp.status_code != 200:
             logging.warning(f"WSJ Market Diary status error: {resp.status_code}")
             return None
@@ -1785,7 +3353,7 @@ def fetch_yahoo_chart_closes(symbol="^NYA", range_key="6mo", interval="1d"):
         "Accept": "application/json,text/plain,*/*"
     }
     try:
-        resp = requests.get(url, params=params, headers=headers, timeout=15)
+        resp = http_client.get(url, params=params, headers=headers, timeout=15)
         if resp.status_code != 200:
             logging.warning(f"Yahoo chart status error {symbol}: {resp.status_code}")
             return []
@@ -1957,8 +3525,9 @@ def calculate_ema(values, period):
         ema_val = (float(v) - ema_val) * k + ema_val
     return ema_val
 
-def fetch_hindenburg_omen():
-    diary_data = fetch_wsj_markets_diary("diaries")
+def fetch_hindenburg_omen(diary_data=None, nyse_closes=None):
+    if diary_data is None:
+        diary_data = fetch_wsj_markets_diary("diaries")
     if not diary_data:
         return None
 
@@ -2093,7 +3662,8 @@ def fetch_hindenburg_omen():
     mcclellan = (ema19 - ema39) if (ema19 is not None and ema39 is not None) else None
     cond_mcclellan_negative = (mcclellan is not None and mcclellan < 0)
 
-    nyse_closes = fetch_yahoo_chart_closes("^NYA", range_key="6mo", interval="1d")
+    if nyse_closes is None:
+        nyse_closes = fetch_yahoo_chart_closes("^NYA", range_key="6mo", interval="1d")
     nyse_latest = nyse_closes[-1] if nyse_closes else None
     nyse_sma50 = None
     nyse_50d_ago = None
@@ -2342,19 +3912,40 @@ def fetch_volatility():
         "state": state
     }
 
-def safe_fetch(label, fn, default):
+def try_fetch(label, fn, *args):
+    """Return (value, True), or (None, False) after logging if fn raised."""
     try:
-        return fn()
+        return fn(*args), True
     except Exception as e:
         logging.warning(f"Failed to fetch {label}: {e}")
-        return default
+        return None, False
 
-def log_debug_timing_summary(phase_times, total_elapsed, external_task_times=None, external_meta=None):
+def safe_fetch(label, fn, default):
+    value, ok = try_fetch(label, fn)
+    return value if ok else default
+
+def log_debug_timing_summary(phase_times, total_elapsed, external_task_times=None, external_meta=None, http_cache_stats=None, http_latency=None):
     logging.info("--- DEBUG TIMING SUMMARY ---")
     for phase, elapsed in sorted(phase_times.items(), key=lambda x: x[1], reverse=True):
         logging.info(f"DEBUG TIMING {phase}: {elapsed:.3f}s")
     logging.info(f"DEBUG TIMING total: {total_elapsed:.3f}s")
 
+    if http_cache_stats:
+        for label, stats in sorted(http_cache_stats.items()):
+            logging.info(
+                f"DEBUG TIMING conditional GET {label}: "
+                f"hits={stats.get('hit', 0)}, misses={stats.get('miss', 0)}"
+            )
+
+    if http_latency:
+        for host, stats in sorted(http_latency.items(), key=lambda x: x[1]["total"], reverse=True):
+            count = stats.get("count", 0)
+            avg = (stats.get("total", 0.0) / count) if count else 0.0
+            logging.info(
+                f"DEBUG TIMING http {host}: requests={count}, errors={stats.get('errors', 0)}, "
+                f"avg={avg:.3f}s, max={stats.get('max', 0.0):.3f}s"
+            )
+
     if external_meta:
         wall_time = external_meta.get("wall_time", 0.0)
         sequential_estimate = external_meta.get("sequential_estimate", 0.0)
@@ -2365,64 +3956,136 @@ def log_debug_timing_summary(phase_times, total_elapsed, external_task_times=Non
             f"wall={wall_time:.3f}s, seq_est={sequential_estimate:.3f}s, "
             f"saved={saved_time:.3f}s, speedup={speedup:.2f}x"
         )
+        task_status = external_meta.get("status") or {}
         if external_task_times:
             for key, elapsed in sorted(external_task_times.items(), key=lambda x: x[1], reverse=True):
-                logging.info(f"DEBUG TIMING external task {key}: {elapsed:.3f}s")
+                status = task_status.get(key, "ok")
+                suffix = f" ({status})" if status != "ok" else ""
+                logging.info(f"DEBUG TIMING external task {key}: {elapsed:.3f}s{suffix}")
+
+async def fetch_hindenburg_omen_async(run_blocking):
+    # WSJ and Yahoo are independent requests; only the evaluation needs both.
+    diary_data, nyse_closes = await asyncio.gather(
+        run_blocking(fetch_wsj_markets_diary, "diaries"),
+        run_blocking(fetch_yahoo_chart_closes, "^NYA", "6mo", "1d")
+    )
+    if not diary_data:
+        return None
+    return await run_blocking(fetch_hindenburg_omen, diary_data, nyse_closes)
 
-def fetch_external_data(include_timing=False):
-    jobs = {
-        "reddit_data": ("ApeWisdom", fetch_apewisdom_rankings, []),
-        "doughcon_data": ("DOUGHCON", fetch_doughcon_level, None),
-        "sahm_data": ("Sahm Rule", fetch_sahm_rule, None),
-        "crypto_fg": ("Crypto Fear & Greed", fetch_crypto_fear_greed, None),
-        "cnn_fg": ("CNN Fear & Greed", fetch_cnn_fear_greed, None),
-        "yield_curve_data": ("Yield Curve", fetch_yield_curve, None),
-        "hy_oas_data": ("HY OAS", fetch_hy_oas, None),
-        "market_breadth_data": ("Market Breadth", fetch_market_breadth, None),
-        "volatility_data": ("Volatility", fetch_volatility, None),
-        "hindenburg_omen_data": ("Hindenburg Omen", fetch_hindenburg_omen, None),
-    }
+async def run_external_jobs(jobs, budget):
+    """
+    Run every external source concurrently, each bounded by its own deadline,
+    and stop waiting once the global budget is spent.
+    Returns {key: (value, status, elapsed)} with status in ok / error / timeout / pending.
+    """
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=min(EXTERNAL_FETCH_WORKERS, max(len(jobs), 1)))
 
-    results = {}
-    task_timings = {}
+    def run_blocking(fn, *args):
+        return loop.run_in_executor(executor, fn, *args)
 
-    def timed_job(label, fn, default):
+    async def run_job(key, label, fn, default, deadline):
         started = time.perf_counter()
-        value = safe_fetch(label, fn, default)
-        return value, time.perf_counter() - started
+        if asyncio.iscoroutinefunction(fn):
+            async def guarded():
+                try:
+                    return await fn(run_blocking), True
+                except Exception as e:
+                    logging.warning(f"Failed to fetch {label}: {e}")
+                    return None, False
+            work = guarded()
+        else:
+            work = run_blocking(try_fetch, label, fn)
+        try:
+            value, ok = await asyncio.wait_for(work, timeout=deadline)
+            status = "ok" if ok else "error"
+            if not ok:
+                value = default
+        except asyncio.TimeoutError:
+            logging.warning(f"{label} exceeded its {deadline:.0f}s deadline")
+            value = default
+            status = "timeout"
+        return key, value, status, time.perf_counter() - started
 
     wall_started = time.perf_counter()
-    with ThreadPoolExecutor(max_workers=min(8, len(jobs))) as executor:
-        future_to_key = {
-            executor.submit(timed_job, label, fn, default): (key, default)
-            for key, (label, fn, default) in jobs.items()
-        }
-        for future in as_completed(future_to_key):
-            key, default = future_to_key[future]
-            try:
-                value, elapsed = future.result()
-                results[key] = value
-                task_timings[key] = elapsed
-            except Exception:
-                results[key] = default
-                task_timings[key] = 0.0
+    tasks = [
+        asyncio.create_task(run_job(key, label, fn, default, deadline))
+        for key, (label, fn, default, deadline) in jobs.items()
+    ]
+    done, pending = await asyncio.wait(tasks, timeout=budget)
+    for task in pending:
+        task.cancel()
+    # Blocking requests cannot be interrupted; let them finish in the background.
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    outcomes = {}
+    for task in done:
+        key, value, status, elapsed = task.result()
+        outcomes[key] = (value, status, elapsed)
+    cutoff = time.perf_counter() - wall_started
+    for key, (label, _, default, _) in jobs.items():
+        if key not in outcomes:
+            logging.warning(f"{label} still running after the {budget:.0f}s external budget")
+            outcomes[key] = (default, "pending", cutoff)
+    return outcomes
+
+def fetch_external_data(include_timing=False):
+    # key: (label, fetcher, default, per-source deadline in seconds)
+    jobs = {
+        "reddit_data": ("ApeWisdom", fetch_apewisdom_rankings, [], 15),
+        "doughcon_data": ("DOUGHCON", fetch_doughcon_level, None, 40),
+        "sahm_data": ("Sahm Rule", fetch_sahm_rule, None, 15),
+        "crypto_fg": ("Crypto Fear & Greed", fetch_crypto_fear_greed, None, 15),
+        "cnn_fg": ("CNN Fear & Greed", fetch_cnn_fear_greed, None, 15),
+        "yield_curve_data": ("Yield Curve", fetch_yield_curve, None, 15),
+        "hy_oas_data": ("HY OAS", fetch_hy_oas, None, 15),
+        "market_breadth_data": ("Market Breadth", fetch_market_breadth, None, 45),
+        "volatility_data": ("Volatility", fetch_volatility, None, 15),
+        "hindenburg_omen_data": ("Hindenburg Omen", fetch_hindenburg_omen_async, None, 35),
+    }
 
+    wall_started = time.perf_counter()
+    outcomes = asyncio.run(run_external_jobs(jobs, EXTERNAL_FETCH_BUDGET))
     wall_elapsed = time.perf_counter() - wall_started
-    for key, (_, _, default) in jobs.items():
-        results.setdefault(key, default)
-        task_timings.setdefault(key, 0.0)
+
+    results = {}
+    task_timings = {}
+    task_status = {}
+    now = time.time()
+    for key, (_, _, default, _) in jobs.items():
+        value, status, elapsed = outcomes[key]
+        # Most fetchers catch their own errors and return the default, so that counts as a failure too.
+        if status == "ok" and value != default:
+            _EXTERNAL_LAST_GOOD[key] = (value, now)
+        elif key in _EXTERNAL_LAST_GOOD:
+            # Reuse the last good value from an earlier cycle rather than dropping the indicator.
+            value, fetched_at = _EXTERNAL_LAST_GOOD[key]
+            status = "stale"
+            logging.info(f"Using stale {key} from {now - fetched_at:.0f}s ago")
+        else:
+            status = "missing"
+        results[key] = value
+        task_timings[key] = elapsed
+        task_status[key] = status
 
     if include_timing:
         sequential_estimate = sum(task_timings.values())
         meta = {
             "wall_time": wall_elapsed,
-            "sequential_estimate": sequential_estimate
+            "sequential_estimate": sequential_estimate,
+            "status": task_status
         }
         return results, task_timings, meta
     return results
 
-def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
+def run_analysis(debug_mode=False, poly_only=False, retry_count=0, text_mode=TEXT_MODE_HEAD, window=None):
+    global _LAST_WINDOW_END
     run_started = time.perf_counter()
+    _HTTP_CACHE_STATS.clear()
+    http_client.reset_latency_stats()
+    with _PARSE_POOL_LOCK:
+        _PARSE_STATS.update(pool=0, inline=0)
     phase_times = {}
     external_task_times = {}
     external_meta = None
@@ -2448,7 +4111,9 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
                 phase_times,
                 time.perf_counter() - run_started,
                 external_task_times,
-                external_meta
+                external_meta,
+                _HTTP_CACHE_STATS,
+                http_client.get_latency_stats()
             )
         logging.info("--- POLYMARKET ONLY MODE ---")
         logging.info(json.dumps(polymarket_data, indent=2, ensure_ascii=False))
@@ -2512,7 +4177,9 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
                 phase_times,
                 time.perf_counter() - run_started,
                 external_task_times,
-                external_meta
+                external_meta,
+                _HTTP_CACHE_STATS,
+                http_client.get_latency_stats()
             )
         logging.info("No threads found.")
         return
@@ -2523,40 +4190,112 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
     earnings_calendar = load_finnhub_calendar()
     ticker_pool = build_ticker_pool(prev_state, reddit_data, limit=40)
     earnings_hints = build_earnings_hints(earnings_calendar, ticker_pool)
+    window_label, window_since = resolve_window(window, prev_state)
+    if window_since is not None:
+        # A time window wants the newest posts; head mode would only hold the oldest ones.
+        if text_mode == TEXT_MODE_HEAD:
+            text_mode = TEXT_MODE_TAIL
+        since_text = datetime.datetime.fromtimestamp(window_since, JST).strftime("%Y-%m-%d %H:%M:%S")
+        logging.info(f"Analysis window: {window_label} (posts since {since_text} JST)")
     phase_times["load_state_and_hints"] = time.perf_counter() - phase_started
 
     phase_started = time.perf_counter()
     all_text_chunks = []
     source_meta = []
-    
-    for t in threads:
-        thread_started = time.perf_counter()
-        text = fetch_thread_text(t["url"], spam)
-        thread_elapsed = time.perf_counter() - thread_started
-        if text:
-            all_text_chunks.append(f"\n--- Thread: {t['name']} ---\n{text}")
-            source_meta.append({"name": t["name"], "url": t["url"]})
+
+    def timed_thread_fetch(t):
+        started = time.perf_counter()
+        state = fetch_thread_posts(t["url"], spam, res_count=t.get("res"), mode=text_mode)
+        return state, time.perf_counter() - started
+
+    # Politeness is enforced per host by host_slot(); executor.map keeps thread order.
+    with ThreadPoolExecutor(max_workers=len(threads)) as executor:
+        fetched = list(executor.map(timed_thread_fetch, threads))
+    # Monitor mode would otherwise hold every thread it has ever seen in memory.
+    prune_thread_parse_states([t["url"] for t in threads])
+    # Taken after the fetch, so posts written while it ran are covered by this run;
+    # anything stamped later (server clock ahead) is left for the next "since-last" window.
+    window_end = time.time()
+
+    signal_scanner = get_ticker_scanner(nicknames, {str(x).upper() for x in exclude if isinstance(x, str)})
+    plans = []
+    plan_threads = []
+    # Hourly topic trends follow board activity, so they see every post in the window.
+    trend_posts = []
+    for t, (state, thread_elapsed) in zip(threads, fetched):
+        if state is not None:
+            selected = window_indices(state["posts"], window_since, window_end)
+            posts = state["posts"]
+            trend_posts.extend(
+                (topic_trend_post_id(t["url"], posts.res[i]), posts.timestamps[i], text)
+                for i, text in zip(selected, posts.texts(selected))
+            )
+            if selected:
+                plans.append(plan_thread_text(t["name"], state, selected, signal_scanner, window_end))
+                plan_threads.append(t)
         if debug_mode:
             logging.info(
                 f"DEBUG TIMING thread_fetch {t['num']}: "
-                f"{thread_elapsed:.3f}s, chars={len(text) if text else 0}"
+                f"{thread_elapsed:.3f}s, posts={len(state['posts']) if state else 0}"
             )
-        time.sleep(1) 
+    # One allocation for both model variants, so no thread text is rendered only to be cut.
+    primary_alloc, fallback_alloc = allocate_text_budget(plans, prompt_text_totals())
+    # Copypasta and posts re-quoted in the next thread only reach the prompt once.
+    # The indexes only see posts that are rendered, so a kept copy is never cut later.
+    near_dups = NearDuplicateIndex()
+    fallback_dups = NearDuplicateIndex()
+    fallback_chunks = []
+    topic_posts = []
+    for t, plan, primary_chars, fallback_chars in zip(plan_threads, plans, primary_alloc, fallback_alloc):
+        posts = plan["state"]["posts"]
+        chosen = near_dups.filter_posts(posts, thread_plan_indices(plan, primary_chars))
+        text = posts.render(chosen)
+        if not text:
+            continue
+        all_text_chunks.append(plan["header"] + text)
+        topic_posts.append(plan["header"])
+        topic_posts.extend(posts.texts(chosen))
+        source_meta.append({"name": t["name"], "url": t["url"]})
+        fallback_chosen = fallback_dups.filter_posts(posts, thread_plan_indices(plan, fallback_chars))
+        fallback_text = posts.render(fallback_chosen)
+        if fallback_text:
+            fallback_chunks.append(plan["header"] + fallback_text)
+        if debug_mode:
+            logging.info(
+                f"DEBUG TEXT_BUDGET {t['num']}: capacity={plan['capacity']}, primary={len(text)}, "
+                f"fallback={len(fallback_text)}, recency={plan['recency']:.2f}, "
+                f"velocity={plan['velocity']}/h, density={plan['density']:.2f}"
+            )
+    if near_dups.dropped:
+        logging.info(f"Near-duplicate filter: dropped {near_dups.dropped} posts, saved {near_dups.chars_saved} chars")
+    if plans:
+        logging.info(
+            f"Text budget: {len(all_text_chunks)} threads, primary {sum(map(len, all_text_chunks))} chars, "
+            f"fallback {sum(map(len, fallback_chunks))} chars"
+        )
     phase_times["thread_fetch_total"] = time.perf_counter() - phase_started
+    if debug_mode:
+        logging.info(
+            f"DEBUG TIMING thread_parse: processes={PARSE_PROCESSES}, "
+            f"offloaded={_PARSE_STATS['pool']}, in_process={_PARSE_STATS['inline']}"
+        )
     
     all_text = "".join(all_text_chunks)
+    fallback_all_text = "".join(fallback_chunks)
     if not all_text.strip():
         if debug_mode:
             log_debug_timing_summary(
                 phase_times,
                 time.perf_counter() - run_started,
                 external_task_times,
-                external_meta
+                external_meta,
+                _HTTP_CACHE_STATS,
+                http_client.get_latency_stats()
             )
         return
 
     phase_started = time.perf_counter()
-    topics = analyze_topics(all_text, stopwords)
+    topics = analyze_topics(topic_posts, stopwords, trend_posts)
     phase_times["topic_analysis"] = time.perf_counter() - phase_started
 
     if debug_mode:
@@ -2564,15 +4303,19 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
             phase_times,
             time.perf_counter() - run_started,
             external_task_times,
-            external_meta
+            external_meta,
+            _HTTP_CACHE_STATS,
+            http_client.get_latency_stats()
         )
         logging.info("DEBUG MODE: Skipping AI and Upload.")
+        _LAST_WINDOW_END = window_end
         return
 
     # Combined Gemini Analysis with Context
     phase_started = time.perf_counter()
     tickers_raw, market_summary, fear_greed, radar_data, ongi_comment, breaking_news, comparative_insight, brief_swing, brief_long, ai_model = analyze_market_data(
-        all_text, exclude, nicknames, prev_state, reddit_data, doughcon_data, sahm_data, earnings_hints
+        all_text, exclude, nicknames, prev_state, reddit_data, doughcon_data, sahm_data, earnings_hints,
+        fallback_text=fallback_all_text
     )
     phase_times["ai_analysis"] = time.perf_counter() - phase_started
     if market_summary == "要約生成失敗":
@@ -2581,10 +4324,11 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
         if retry_count < 1:
             logging.info("Waiting 10 minutes before retrying process from the beginning...")
             time.sleep(600)
-            return run_analysis(debug_mode, poly_only, retry_count + 1)
+            return run_analysis(debug_mode, poly_only, retry_count + 1, text_mode, window)
         else:
             logging.error("Retry failed or limit reached. Aborting upload.")
             return
+    _LAST_WINDOW_END = window_end
 
     agg = {}
     for t in tickers_raw:
@@ -2643,6 +4387,8 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
     try:
         current_state = {
             "timestamp": time.time(),
+            "posts_until": window_end,
+            "window": window_label,
             "rankings": final_items[:20],
             "fear_greed": fear_greed,
             "radar": radar_data,
@@ -2688,7 +4434,8 @@ def run_analysis(debug_mode=False, poly_only=False, retry_count=0):
         final_items, topics, source_meta, market_summary, ongi_comment, fear_greed, radar_data,
         breaking_news, polymarket_data, cnn_fg, reddit_data, comparative_insight,
         brief_swing, brief_long, ai_model, doughcon_data, sahm_data, yield_curve_data,
-        crypto_fg, hy_oas_data, market_breadth_data, volatility_data, hindenburg_omen_data
+        crypto_fg, hy_oas_data, market_breadth_data, volatility_data, hindenburg_omen_data,
+        window=window_label
     )
 
 if __name__ == "__main__":
@@ -2697,16 +4444,25 @@ if __name__ == "__main__":
     parser.add_argument("--debug", action="store_true", help="Run in debug mode (no upload)")
     parser.add_argument("--poly-only", action="store_true", help="Run only Polymarket fetch/translate experiment")
     parser.add_argument("--monitor", action="store_true", help="Run in monitor mode (loop every 120s)")
+    parser.add_argument(
+        "--window",
+        default=THREAD_WINDOW,
+        help="Posts to analyze: 24h (full thread budgets), since-last, or last N minutes/hours like 90m, 6h"
+    )
     args = parser.parse_args()
 
     if args.monitor:
         logging.info("--- MONITOR MODE (120s) ---")
+        # Monitor mode cares about the latest posts, so it keeps the tail of each thread by default.
+        text_mode = THREAD_TEXT_MODE if THREAD_TEXT_MODE in TEXT_MODES else TEXT_MODE_TAIL
         try:
             while True:
-                run_analysis(debug_mode=args.debug, poly_only=args.poly_only)
+                run_analysis(debug_mode=args.debug, poly_only=args.poly_only, text_mode=text_mode, window=args.window)
                 logging.info("Waiting 120s...")
                 time.sleep(120) 
         except KeyboardInterrupt:
             logging.info("Monitor stopped.")
     else:
-        run_analysis(debug_mode=args.debug)
+        # Scheduled runs send the highest-signal posts of each thread.
+        text_mode = THREAD_TEXT_MODE if THREAD_TEXT_MODE in TEXT_MODES else TEXT_MODE_SCORE
+        run_analysis(debug_mode=args.debug, text_mode=text_mode, window=args.window)
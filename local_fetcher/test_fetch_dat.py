@@ -0,0 +1,149 @@
+"""
+Tests for the incremental DAT fetch against a fake 5ch server.
+
+Run from local_fetcher/: python -m unittest test_fetch_dat
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BASE_DIR)
+# Importing main exits without a key.
+os.environ.setdefault("GEMINI_API_KEY", "test")
+
+import main
+
+THREAD_URL = "https://egg.5ch.net/test/read.cgi/stock/1700000000/"
+THREAD_ID = "1700000000"
+
+
+class FakeResponse:
+    def __init__(self, status_code, content=b"", headers=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+
+
+class FakeDatServer:
+    """Serves one DAT with ETag and byte-range support, like the 5ch servers."""
+
+    def __init__(self):
+        self.dat = b""
+
+    def get(self, url, retry=None, headers=None, **kwargs):
+        headers = headers or {}
+        etag = f'"{len(self.dat)}"'
+        if headers.get("If-None-Match") == etag:
+            return FakeResponse(304, headers={"ETag": etag})
+        byte_range = headers.get("Range")
+        if byte_range:
+            start = int(byte_range.split("=")[1].rstrip("-"))
+            if start >= len(self.dat):
+                return FakeResponse(416)
+            return FakeResponse(206, self.dat[start:], {"ETag": etag})
+        return FakeResponse(200, self.dat, {"ETag": etag})
+
+
+def make_dat(count, first=1):
+    lines = []
+    for res in range(first, first + count):
+        lines.append(f"名無し<>sage<>2026/10/17(土) 12:{res % 60:02d}:00.00 ID:id{res % 7}<> 投稿 {res} NVDA <>")
+    return ("\n".join(lines) + "\n").encode("cp932")
+
+
+class FetchDatIncrementalTest(unittest.TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.saved = {
+            name: getattr(main, name)
+            for name in ("CACHE_DIR", "DAT_INDEX_FILE", "HTTP_META_FILE", "_DAT_INDEX", "_HTTP_META")
+        }
+        main.CACHE_DIR = self.cache_dir
+        main.DAT_INDEX_FILE = os.path.join(self.cache_dir, "index.json")
+        main.HTTP_META_FILE = os.path.join(self.cache_dir, "http_meta.json")
+        main._DAT_INDEX = None
+        main._HTTP_META = None
+        main._THREAD_PARSE_STATES.clear()
+        self.server = FakeDatServer()
+        self.saved_get = main.http_client.get
+        main.http_client.get = self.server.get
+
+    def tearDown(self):
+        main.http_client.get = self.saved_get
+        for name, value in self.saved.items():
+            setattr(main, name, value)
+        main._THREAD_PARSE_STATES.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def last_res(self):
+        return main.load_dat_index()[THREAD_ID]["last_res"]
+
+    def test_appended_posts_are_fetched_by_range(self):
+        self.server.dat = make_dat(50)
+        main.fetch_thread_posts(THREAD_URL)
+        self.server.dat += make_dat(5, first=51)
+        main.fetch_thread_posts(THREAD_URL)
+        self.assertEqual(self.last_res(), 55)
+
+    def test_shrunk_dat_is_refetched(self):
+        self.server.dat = make_dat(60)
+        main.fetch_thread_posts(THREAD_URL)
+        self.assertEqual(self.last_res(), 60)
+
+        # Rewritten upstream: shorter than the cached offset, so the range request gets 416.
+        self.server.dat = make_dat(54)
+        state = main.fetch_thread_posts(THREAD_URL)
+        self.assertEqual(self.last_res(), 54)
+        self.assertEqual(state["posts"].res[len(state["posts"]) - 1], 54)
+        with open(main.dat_cache_path(THREAD_ID), "rb") as f:
+            self.assertEqual(f.read(), self.server.dat)
+
+    def test_parse_states_are_pruned_to_current_threads(self):
+        self.server.dat = make_dat(50)
+        other_url = THREAD_URL.replace(THREAD_ID, "1700000001")
+        kept = len(main.fetch_thread_posts(THREAD_URL)["posts"])
+        main.fetch_thread_posts(other_url)
+        main.prune_thread_parse_states([other_url])
+        self.assertEqual(list(main._THREAD_PARSE_STATES), ["1700000001"])
+        # A pruned thread reloads from its caches on the next fetch.
+        self.assertEqual(len(main.fetch_thread_posts(THREAD_URL)["posts"]), kept)
+
+    def test_eviction_counts_and_removes_parsed_cache(self):
+        self.server.dat = make_dat(50)
+        main.fetch_thread_posts(THREAD_URL)
+        entry = main.load_dat_index()[THREAD_ID]
+        parsed_path = main.parsed_cache_path(THREAD_ID)
+        self.assertEqual(entry["parsed_size"], os.path.getsize(parsed_path))
+
+        # The DAT alone fits the budget; DAT plus parsed cache does not.
+        saved_budget = main.DAT_CACHE_BUDGET_BYTES
+        main.DAT_CACHE_BUDGET_BYTES = entry["size"]
+        try:
+            self.assertEqual(main.evict_dat_cache(), [THREAD_ID])
+        finally:
+            main.DAT_CACHE_BUDGET_BYTES = saved_budget
+        self.assertFalse(os.path.exists(parsed_path))
+        self.assertFalse(os.path.exists(main.dat_cache_path(THREAD_ID)))
+
+    def test_lost_index_is_rebuilt_from_cp932_store(self):
+        self.server.dat = make_dat(50)
+        main.fetch_thread_posts(THREAD_URL)
+        with open(os.path.join(self.cache_dir, "1700000001.dat.gz"), "wb") as f:
+            f.write(b"not gzip")
+        os.remove(main.DAT_INDEX_FILE)
+        main._DAT_INDEX = None
+
+        index = main.load_dat_index()
+        self.assertEqual(list(index), [THREAD_ID])
+        self.assertEqual(index[THREAD_ID]["last_res"], 50)
+        with open(main.dat_cache_path(THREAD_ID), "rb") as f:
+            self.assertEqual(f.read(), self.server.dat)
+        # Unreadable files are removed, not left outside the manifest.
+        self.assertFalse(os.path.exists(os.path.join(self.cache_dir, "1700000001.dat.gz")))
+
+
+if __name__ == "__main__":
+    unittest.main()
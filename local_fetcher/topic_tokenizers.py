@@ -0,0 +1,187 @@
+"""
+Morphological analyzer backends for analyze_topics.
+
+Topic extraction only needs each token's surface and its first two
+part-of-speech levels in IPADIC terms ("名詞", "一般"), which main.py then
+filters. They are served by the fastest analyzer that is installed:
+fugashi (MeCab), then SudachiPy, then the pure-Python Janome, and finally a
+regex that treats every kanji/katakana/latin run as a noun.
+tokens() yields (surface, pos) where pos is the analyzer's own hashable POS
+value, so the filter can cache its decision per value; pos_tags(pos) turns
+it into the IPADIC (main, sub) pair.
+TOPIC_TOKENIZER forces one of "fugashi", "sudachi", "janome" or "regex".
+
+fugashi with the ipadic package yields the same POS tags as Janome (both use
+mecab-ipadic). UniDic (fugashi's default dictionary, and Sudachi's) tags are
+mapped onto the IPADIC names the filter checks; segmentation still differs a
+little, so compare the top-50 with `python bench.py topics` before switching.
+"""
+import logging
+import os
+import re
+
+try:
+    import fugashi
+except ImportError:
+    fugashi = None
+
+try:
+    import ipadic
+except ImportError:
+    ipadic = None
+
+try:
+    from sudachipy import dictionary as sudachi_dictionary
+    from sudachipy import tokenizer as sudachi_tokenizer
+except ImportError:
+    sudachi_dictionary = None
+    sudachi_tokenizer = None
+
+try:
+    from janome.tokenizer import Tokenizer as JanomeTokenizer
+except ImportError:
+    JanomeTokenizer = None
+
+NOUN = "名詞"
+# UniDic POS -> IPADIC (main, sub) for the tags the topic filter looks at.
+UNIDIC_MAIN_POS = {"代名詞": (NOUN, "代名詞"), "接尾辞": (NOUN, "接尾")}
+UNIDIC_NOUN_SUB_POS = {"数詞": "数", "助動詞語幹": "非自立"}
+# Sudachi rejects inputs over ~49KB, so long texts go in line batches.
+SUDACHI_MAX_CHARS = 12000
+REGEX_WORD_PATTERN = re.compile(r"([一-龠ァ-ヶa-zA-Z]{2,})")
+REGEX_POS = (NOUN, "一般")
+
+
+def unidic_pos(pos1, pos2):
+    mapped = UNIDIC_MAIN_POS.get(pos1)
+    if mapped:
+        return mapped
+    if pos1 == NOUN:
+        return NOUN, UNIDIC_NOUN_SUB_POS.get(pos2, pos2)
+    return pos1, pos2
+
+
+def _line_batches(text, limit):
+    batch = []
+    size = 0
+    for line in text.split("\n"):
+        if batch and size + len(line) + 1 > limit:
+            yield "\n".join(batch)
+            batch = []
+            size = 0
+        batch.append(line[:limit])
+        size += len(line) + 1
+    if batch:
+        yield "\n".join(batch)
+
+
+class FugashiBackend:
+    def __init__(self):
+        if ipadic is not None:
+            self.tagger = fugashi.GenericTagger(ipadic.MECAB_ARGS)
+            self.ipadic = True
+            self.name = "fugashi-ipadic"
+        else:
+            # Needs unidic-lite or a downloaded unidic.
+            self.tagger = fugashi.Tagger()
+            self.ipadic = False
+            self.name = "fugashi-unidic"
+
+    def tokens(self, text):
+        if self.ipadic:
+            for word in self.tagger(text):
+                feature = word.feature
+                yield word.surface, (feature[0], feature[1] if len(feature) > 1 else "*")
+        else:
+            for word in self.tagger(text):
+                yield word.surface, word.pos
+
+    def pos_tags(self, pos):
+        if self.ipadic:
+            return pos
+        parts = pos.split(",")
+        return unidic_pos(parts[0], parts[1])
+
+
+class SudachiBackend:
+    name = "sudachi"
+
+    def __init__(self):
+        self.dictionary = sudachi_dictionary.Dictionary()
+        self.tokenizer = self.dictionary.tokenizer() if hasattr(self.dictionary, "tokenizer") else self.dictionary.create()
+        # Mode B units are the closest to IPADIC's.
+        self.mode = sudachi_tokenizer.Tokenizer.SplitMode.B
+
+    def tokens(self, text):
+        for batch in _line_batches(text, SUDACHI_MAX_CHARS):
+            for morpheme in self.tokenizer.tokenize(batch, self.mode):
+                yield morpheme.surface(), morpheme.part_of_speech_id()
+
+    def pos_tags(self, pos):
+        tags = self.dictionary.pos_of(pos)
+        return unidic_pos(tags[0], tags[1])
+
+
+class JanomeBackend:
+    name = "janome"
+
+    def __init__(self):
+        self.tokenizer = JanomeTokenizer()
+
+    def tokens(self, text):
+        for token in self.tokenizer.tokenize(text):
+            yield token.surface, token.part_of_speech
+
+    def pos_tags(self, pos):
+        pos_parts = pos.split(',')
+        return pos_parts[0], pos_parts[1]
+
+
+class RegexBackend:
+    name = "regex"
+
+    def tokens(self, text):
+        for word in REGEX_WORD_PATTERN.findall(text):
+            yield word, REGEX_POS
+
+    def pos_tags(self, pos):
+        return pos
+
+
+BACKENDS = {
+    "fugashi": (FugashiBackend, lambda: fugashi is not None),
+    "sudachi": (SudachiBackend, lambda: sudachi_dictionary is not None),
+    "janome": (JanomeBackend, lambda: JanomeTokenizer is not None),
+    "regex": (RegexBackend, lambda: True),
+}
+_BACKEND = None
+
+
+def available_backends():
+    return [name for name, (_, usable) in BACKENDS.items() if usable()]
+
+
+def get_backend(name=None):
+    """Return the named backend, or the preferred installed one that starts."""
+    global _BACKEND
+    if name:
+        backend_cls, usable = BACKENDS[name]
+        if not usable():
+            raise RuntimeError(f"Tokenizer not installed: {name}")
+        return backend_cls()
+    if _BACKEND is None:
+        forced = os.getenv("TOPIC_TOKENIZER", "").strip().lower()
+        names = available_backends()
+        if forced and forced not in names:
+            logging.warning(f"TOPIC_TOKENIZER={forced} unavailable, using {names[0]}")
+            forced = ""
+        for candidate in ([forced] if forced else []) + names:
+            try:
+                # A package can be installed without a usable dictionary.
+                _BACKEND = BACKENDS[candidate][0]()
+                break
+            except Exception as e:
+                logging.warning(f"Tokenizer {candidate} failed to start: {e}")
+        if _BACKEND.name == "regex":
+            logging.warning("No morphological analyzer installed. Falling back to Regex.")
+    return _BACKEND
@@ -4,6 +4,7 @@ let radarChart = null;
 let ongiHistoryChart = null; // NEW GLOBAL
 let currentTicker = null;
 let currentTopics = [];
+let surgingTopics = new Set();
 let currentItems = [];
 let currentPolymarket = null;
 let latestData = null;
@@ -1234,6 +1235,7 @@ async function main() {
     // Store topics
     if (data.topics) {
       currentTopics = data.topics.map(t => [t.word, t.count]);
+      surgingTopics = new Set(data.topics.filter(t => t.surging).map(t => t.word));
       if (document.getElementById("view-topics").style.display !== "none") {
         renderWordCloud();
       }
@@ -1624,7 +1626,9 @@ function renderWordCloud() {
     },
     fontFamily: '"Inter", "JetBrains Mono", sans-serif',
     color: function (word, weight) {
-      const colors = ['#00f0ff', '#ffd700', '#ffffff', '#ff003c', '#adff00'];
+      // Surging topics (hourly rate well above their baseline) always stand out in red
+      if (surgingTopics.has(word)) return '#ff003c';
+      const colors = ['#00f0ff', '#ffd700', '#ffffff', '#adff00'];
       return colors[Math.floor(Math.random() * colors.length)];
     },
     rotateRatio: rotationRatio,
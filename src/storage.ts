@@ -18,7 +18,7 @@ export interface RadarData {
   iq: number;
 }
 
-export type TopicItem = { word: string; count: number };
+export type TopicItem = { word: string; count: number; trend?: number; surging?: boolean };
 
 
 export interface InvestBriefItem {